@@ -0,0 +1,15 @@
+# src/_bootstrap.py
+"""
+Carga .env una sola vez por proceso (y por árbol de procesos).
+
+Los módulos que leen variables de entorno al importarse hacen `import _bootstrap`
+antes de sus constantes; Python ejecuta este módulo solo la primera vez, y la
+marca en os.environ evita re-parsear .env en procesos hijos (workers de plot_prices).
+"""
+import os
+
+from dotenv import load_dotenv
+
+if not os.getenv("_DOTENV_LOADED"):
+    load_dotenv()
+    os.environ["_DOTENV_LOADED"] = "1"
@@ -0,0 +1,101 @@
+# src/_cache.py
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import _bootstrap  # noqa: F401
+
+try:
+    import orjson  # C: más rápido que json y devuelve bytes directamente
+except ImportError:
+    orjson = None  # type: ignore[assignment]
+
+# Caché en disco direccionada por contenido (clave = sha256 de la petición)
+CACHE_ROOT = Path(os.getenv("CACHE_DIR", "~/.cache/daily-companion")).expanduser()
+DEFAULT_TTL_S = int(os.getenv("CACHE_TTL_SECONDS", str(6 * 3600)))
+MAX_MB = int(os.getenv("CACHE_MAX_MB", "50"))
+
+
+def dumps(obj: Any, sort_keys: bool = False) -> bytes:
+    """JSON compacto en bytes (orjson si está instalado; json como respaldo)."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+    return json.dumps(obj, sort_keys=sort_keys, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data: bytes) -> Any:
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def make_key(payload: Dict[str, Any]) -> str:
+    """sha256 (hex) de la petición serializada de forma canónica."""
+    return hashlib.sha256(dumps(payload, sort_keys=True)).hexdigest()
+
+
+def atomic_write(path: Path, data: bytes) -> None:
+    """Escribe vía tempfile + os.replace para no dejar archivos a medias."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def get(key: str, ns: str = "openai", ttl: int = DEFAULT_TTL_S) -> Optional[Any]:
+    """Devuelve el valor cacheado o None si no existe / expiró (mtime > ttl)."""
+    path = CACHE_ROOT / ns / key
+    try:
+        if time.time() - path.stat().st_mtime > ttl:
+            return None
+        return loads(path.read_bytes())
+    except (OSError, ValueError):
+        return None
+
+
+def put(key: str, val: Any, ns: str = "openai") -> None:
+    """Guarda el valor (silencioso si falla: la caché nunca rompe el flujo)."""
+    base = CACHE_ROOT / ns
+    try:
+        atomic_write(base / key, dumps(val))
+        _evict(base, MAX_MB << 20)
+    except (OSError, TypeError):
+        pass
+
+
+def _evict(base: Path, max_bytes: int) -> None:
+    """LRU por atime: borra los más viejos hasta quedar bajo max_bytes."""
+    entries = []
+    total = 0
+    for p in base.glob("*"):
+        if p.name.startswith(".tmp-"):
+            continue
+        try:
+            st = p.stat()
+        except OSError:
+            continue
+        entries.append((st.st_atime, st.st_size, p))
+        total += st.st_size
+    if total <= max_bytes:
+        return
+    entries.sort()
+    for _, size, p in entries:
+        try:
+            p.unlink()
+        except OSError:
+            continue
+        total -= size
+        if total <= max_bytes:
+            break
@@ -2,10 +2,28 @@
 from __future__ import annotations
 import os
 import re
+import time
 from datetime import datetime
+from itertools import chain
+from operator import itemgetter
 from typing import Any, Dict, List
 
+import _bootstrap  # noqa: F401
+import _cache
+
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "").strip()
+DIGEST_CACHE_TTL = 6 * 3600  # mismos titulares/mercados dentro de 6h -> misma respuesta
+
+
+def _pub_key(pub: Any) -> str:
+    """Clave de orden como str ISO; sin fecha -> "" (queda al final)."""
+    if not pub:
+        return ""
+    if isinstance(pub, datetime):
+        return pub.isoformat()
+    if isinstance(pub, time.struct_time):
+        return time.strftime("%Y-%m-%dT%H:%M:%S", pub)
+    return str(pub)
 
 
 def _pick_headlines(news: List[Dict[str, Any]], k: int = 5) -> List[str]:
@@ -14,32 +32,32 @@ def _pick_headlines(news: List[Dict[str, Any]], k: int = 5) -> List[str]:
         title = (n.get("title") or "").strip()
         if not title:
             continue
-        pub = n.get("published")
-        items.append((pub, title))
-    # más recientes primero si hay fecha; si no, mantiene orden de llegada
-    try:
-        items.sort(key=lambda t: (str(t[0]) or ""), reverse=True)
-    except Exception:
-        pass
+        items.append((_pub_key(n.get("published")), title))
+    # más recientes primero si hay fecha; empates mantienen el orden de llegada
+    items.sort(key=itemgetter(0), reverse=True)
     titles = [t for _, t in items][:k]
     if not titles and news:
         titles = [(n.get("title") or "").strip() for n in news[:k] if n.get("title")]
     return [t for t in titles if t]
 
 
+_MARKET_ALIASES = {"^GSPC": "SPY"}  # si no hay ^GSPC, se reporta con el dato de SPY
+
+
 def _mk_markets_blurb(stats: Dict[str, Dict[str, float]]) -> str:
     if not stats:
         return ""
-    parts = []
-    for tk in ("NVDA", "MSFT", "AMZN", "TSLA", "SPY", "^GSPC"):
-        s = stats.get(tk) or (stats.get("SPY") if tk == "^GSPC" else None)
-        if not s:
-            continue
-        pct = s.get("pct_change")
-        if pct is None:
-            continue
-        parts.append(f"{tk} {pct:+.2f}%")
-    return " | ".join(parts)
+    return " | ".join(
+        f"{tk} {s['pct_change']:+.2f}%"
+        for tk in ("NVDA", "MSFT", "AMZN", "TSLA", "SPY", "^GSPC")
+        for s in (stats.get(tk) or stats.get(_MARKET_ALIASES.get(tk, "")),)
+        if s and s.get("pct_change") is not None
+    )
+
+
+def _ul_html(items: List[str]) -> str:
+    """<ul><li>…</li></ul> con un solo join sobre partes literales (sin f-strings por ítem)."""
+    return "".join(chain(("<ul>",), chain.from_iterable(("<li>", t, "</li>") for t in items), ("</ul>",)))
 
 
 def _heuristic_digest(news: List[Dict[str, Any]], stats: Dict[str, Dict[str, float]], k: int = 5) -> str:
@@ -47,7 +65,7 @@ def _heuristic_digest(news: List[Dict[str, Any]], stats: Dict[str, Dict[str, flo
     markets = _mk_markets_blurb(stats)
     blocks = []
     if titles:
-        blocks.append("<ul>" + "".join(f"<li>{t}</li>" for t in titles) + "</ul>")
+        blocks.append(_ul_html(titles))
     if markets:
         blocks.append(f"<p><strong>Markets:</strong> {markets}</p>")
     if not blocks:
@@ -56,32 +74,23 @@ def _heuristic_digest(news: List[Dict[str, Any]], stats: Dict[str, Dict[str, flo
 
 
 # ---------- Limpieza de respuestas del modelo ----------
-_CODE_FENCE_RE = re.compile(r"^```[\w-]*\s*$")
+# Líneas que son solo ``` o ```html (una sola pasada con re.sub, sin splitlines/join)
+_CODE_FENCE_SUB = re.compile(r"(?m)^[ \t]*```[\w-]*[ \t]*\r?(?:\n|$)")
 _HTML_FIRST_TAG_RE = re.compile(r"<(ul|ol|p|h[1-6]|div|section|article)\b", re.I)
 
 def _strip_code_fences(text: str) -> str:
-    # Quita líneas que son ``` o ```html
-    lines = [ln for ln in text.splitlines() if not _CODE_FENCE_RE.match(ln.strip())]
-    return "\n".join(lines).strip()
-
-def _trim_to_first_html_block(text: str) -> str:
-    """
-    Recorta cualquier prefacio antes del primer tag HTML 'real'.
-    Si no encuentra, devuelve el original.
-    """
-    m = _HTML_FIRST_TAG_RE.search(text)
-    if not m:
-        return text.strip()
-    return text[m.start():].strip()
+    return _CODE_FENCE_SUB.sub("", text).strip()
 
 def _sanitize_model_html(text: str, fallback_titles: List[str], markets: str) -> str:
     # 1) quitar backticks
     t = _strip_code_fences(text or "")
-    # 2) recortar prefacio hasta el primer tag
-    t = _trim_to_first_html_block(t)
+    # 2) recortar prefacio hasta el primer tag HTML 'real' (si no hay, queda igual)
+    m = _HTML_FIRST_TAG_RE.search(t)
+    if m:
+        t = t[m.start():]
     # 3) si aún no parece HTML, hacemos fallback mínimo
     if "<" not in t or ">" not in t:
-        base = "<ul>" + "".join(f"<li>{h}</li>" for h in fallback_titles) + "</ul>"
+        base = _ul_html(fallback_titles)
         if markets:
             base += f"\n<p><strong>Markets:</strong> {markets}</p>"
         return base
@@ -89,32 +98,80 @@ def _sanitize_model_html(text: str, fallback_titles: List[str], markets: str) ->
 
 
 # ---------- Vía OpenAI (si hay API key), con sanitización ----------
+# Instrucciones fijas (sin interpolación): prefijo idéntico entre corridas,
+# así el proveedor puede reutilizar su caché de prefijos.
+_DIGEST_INSTRUCTIONS = (
+    "You are a concise assistant. Create a compact HTML snippet for an email body with:\n"
+    "- The given top headlines as bullet points (short, no fluff)\n"
+    "- One line with key market moves if provided.\n"
+    "Return ONLY HTML (ul/li, p, strong). No Markdown fences, no preface."
+)
+
+
+_openai_client: Any = None
+
+
+def _get_client() -> Any:
+    """
+    Cliente OpenAI único por proceso. El SDK se importa aquí, al primer uso:
+    `import agent` no lo paga cuando no hay OPENAI_API_KEY. None si no está instalado.
+    """
+    global _openai_client
+    if _openai_client is None:
+        try:
+            from openai import OpenAI  # pip install openai
+        except ImportError:
+            return None
+        _openai_client = OpenAI(api_key=OPENAI_API_KEY)
+    return _openai_client
+
+
+def _chat_cached(client: Any, ttl: int = _cache.DEFAULT_TTL_S, **req: Any) -> str:
+    """
+    chat.completions.create con caché exacta en disco: misma petición
+    (model, messages, temperature, max_tokens) -> mismo texto, sin red.
+    """
+    key = _cache.make_key(req)
+    hit = _cache.get(key, ttl=ttl)
+    if hit is not None:
+        return hit
+    resp = client.chat.completions.create(**req)
+    text = resp.choices[0].message.content.strip()
+    _cache.put(key, text)
+    return text
+
+
 def _openai_digest(news: List[Dict[str, Any]], stats: Dict[str, Dict[str, float]], k: int = 5) -> str:
+    titles = _pick_headlines(news, k=k)
+    markets = _mk_markets_blurb(stats)
+    # Sin titulares ni mercados no hay nada que resumir: sin llamada al modelo
+    if not titles and not markets:
+        return _heuristic_digest(news, stats, k=k)
+
     try:
-        from openai import OpenAI  # pip install openai
-        client = OpenAI(api_key=OPENAI_API_KEY)
+        client = _get_client()
     except Exception:
+        client = None
+    if client is None:
         return _heuristic_digest(news, stats, k=k)
 
-    titles = _pick_headlines(news, k=k)
-    markets = _mk_markets_blurb(stats)
-
+    # Parte dinámica SIEMPRE al final: el prefijo estático queda cacheable
     prompt = (
-        "You are a concise assistant. Create a compact HTML snippet for an email body with:\n"
-        f"- Top {len(titles)} headlines as bullet points (short, no fluff)\n"
-        "- One line with key market moves if provided.\n"
-        "Return ONLY HTML (ul/li, p, strong). No Markdown fences, no preface.\n\n"
-        f"Headlines:\n" + "\n".join(f"- {t}" for t in titles) + "\n\n"
+        f"Top {len(titles)} headlines:\n" + "\n".join(f"- {t}" for t in titles) + "\n\n"
         f"Markets: {markets or '(none)'}\n"
     )
     try:
-        resp = client.chat.completions.create(
+        raw = _chat_cached(
+            client,
+            ttl=DIGEST_CACHE_TTL,
             model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-            messages=[{"role": "user", "content": prompt}],
+            messages=[
+                {"role": "system", "content": _DIGEST_INSTRUCTIONS},
+                {"role": "user", "content": prompt},
+            ],
             temperature=0.2,
             max_tokens=300,
         )
-        raw = resp.choices[0].message.content.strip()
         return _sanitize_model_html(raw, titles, markets)
     except Exception:
         return _heuristic_digest(news, stats, k=k)
@@ -133,15 +190,19 @@ def ai_decision(system_prompt: str, user_prompt: str) -> str:
     """
     Devuelve texto (no HTML obligatorio) de una llamada libre al modelo.
     Si no hay OPENAI_API_KEY, devuelve un resumen heurístico mínimo.
+    system_prompt debe ser estático (sin fechas ni datos variables): va primero
+    y así aprovecha la caché de prefijos del proveedor; lo dinámico va en user_prompt.
     """
     if not OPENAI_API_KEY:
         # Fallback simple: eco recortado
         return (user_prompt or "").strip()[:400]
 
     try:
-        from openai import OpenAI
-        client = OpenAI(api_key=OPENAI_API_KEY)
-        resp = client.chat.completions.create(
+        client = _get_client()
+        if client is None:
+            return (user_prompt or "").strip()[:400]
+        return _chat_cached(
+            client,
             model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -150,6 +211,5 @@ def ai_decision(system_prompt: str, user_prompt: str) -> str:
             temperature=0.3,
             max_tokens=300,
         )
-        return resp.choices[0].message.content.strip()
     except Exception:
         return (user_prompt or "").strip()[:400]
\ No newline at end of file
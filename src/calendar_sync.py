@@ -1,32 +1,67 @@
+import functools
+import hashlib
 import os
-from datetime import datetime, timedelta, date
-from typing import List, Tuple, Any, Dict
+import re
+import uuid
+from datetime import datetime, timedelta, date, timezone
+from pathlib import Path
+from typing import List, Tuple, Any, Dict, Optional
 
-from dotenv import load_dotenv
 import requests
-import pytz
 from icalendar import Calendar as ICal
 
-load_dotenv()
+import _bootstrap  # noqa: F401
+import _cache
 
 TZ_NAME = os.getenv("TZ", "America/Mexico_City")
 STUDY_BLOCK_MIN = int(os.getenv("STUDY_BLOCK_MINUTES", "60"))
 ICAL_URL = os.getenv("GOOGLE_ICAL_URL", "")
 
+# Zona horaria resuelta una sola vez (zoneinfo de la stdlib; pytz si no hay tzdata)
+try:
+    from zoneinfo import ZoneInfo
+    _TZ: Any = ZoneInfo(TZ_NAME)
+except Exception:
+    import pytz
+    _TZ = pytz.timezone(TZ_NAME)
+
 # Ventana laboral para sugerir estudio
 WORKDAY_START = 8    # 08:00
 WORKDAY_END = 21     # 21:00
 
+# Sesión compartida (reutiliza TCP/TLS) + caché condicional (ETag/Last-Modified)
+_SESSION = requests.Session()
+_ICAL_CACHE_DIR = _cache.CACHE_ROOT / "ical"
+ICAL_MAX_BYTES = 16 << 20  # tope de descarga (una URL mal configurada no agota la memoria)
+
+# Pre-filtro textual de VEVENTs (antes de construir el árbol de icalendar)
+_VEVENT_RE = re.compile(r"BEGIN:VEVENT\r?\n.*?END:VEVENT\r?\n?", re.S)
+_DTSTART_RE = re.compile(r"^DTSTART[^:\r\n]*:(\d{8})", re.M)
+_DTEND_RE = re.compile(r"^DTEND[^:\r\n]*:(\d{8})", re.M)
+_RECUR_RE = re.compile(r"^(?:RRULE|RDATE)[;:]", re.M)
+
+
+def _localize(naive: datetime) -> datetime:
+    """naive -> aware en _TZ (pytz requiere localize; con zoneinfo basta replace)."""
+    localize = getattr(_TZ, "localize", None)
+    return localize(naive) if localize else naive.replace(tzinfo=_TZ)
 
-def _today_window(tzname: str) -> Tuple[datetime, datetime]:
-    tz = pytz.timezone(tzname)
-    now = datetime.now(tz)
-    start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    end = start + timedelta(days=1)
+
+@functools.lru_cache(maxsize=2)
+def _today_window_cached(ymd: str) -> Tuple[datetime, datetime]:
+    d = date.fromisoformat(ymd)
+    nxt = d + timedelta(days=1)
+    start = _localize(datetime(d.year, d.month, d.day))
+    end = _localize(datetime(nxt.year, nxt.month, nxt.day))
     return start, end
 
 
-def _to_local_dt(val: Any, tz: Any) -> datetime:
+def _today_window() -> Tuple[datetime, datetime]:
+    # La clave es la fecha local: la caché se invalida sola a medianoche
+    return _today_window_cached(datetime.now(_TZ).date().isoformat())
+
+
+def _to_local_dt(val: Any) -> datetime:
     """
     Convierte DTSTART/DTEND que pueden venir como date o datetime a datetime con TZ local.
     - Si es 'date' (evento de día completo), lo tratamos como 00:00 local.
@@ -34,20 +69,84 @@ def _to_local_dt(val: Any, tz: Any) -> datetime:
     """
     if isinstance(val, datetime):
         if val.tzinfo is None:
-            return tz.localize(val)
-        return val.astimezone(tz)
+            return _localize(val)
+        return val.astimezone(_TZ)
     if isinstance(val, date):
         # Evento de día completo: medianoche local
-        return tz.localize(datetime(val.year, val.month, val.day, 0, 0, 0))
+        return _localize(datetime(val.year, val.month, val.day, 0, 0, 0))
     raise ValueError(f"No se pudo interpretar la fecha: {repr(val)}")
 
 
+def _download_ical(headers: Dict[str, str]) -> Tuple[int, Any, bytes]:
+    """GET en streaming con tope ICAL_MAX_BYTES. Un 304 no lee cuerpo."""
+    with _SESSION.get(ICAL_URL, headers=headers, timeout=30, stream=True) as resp:
+        if resp.status_code == 304:
+            return 304, resp.headers, b""
+        resp.raise_for_status()
+        buf = bytearray()
+        for chunk in resp.iter_content(65536):
+            buf.extend(chunk)
+            if len(buf) > ICAL_MAX_BYTES:
+                raise ValueError(f"iCal demasiado grande (> {ICAL_MAX_BYTES >> 20} MiB)")
+        return resp.status_code, resp.headers, bytes(buf)
+
+
 def _fetch_calendar_bytes() -> bytes:
     if not ICAL_URL:
         raise ValueError("Falta GOOGLE_ICAL_URL en .env")
-    resp = requests.get(ICAL_URL, timeout=30)
-    resp.raise_for_status()
-    return resp.content  # bytes
+    base = _ICAL_CACHE_DIR / hashlib.sha256(ICAL_URL.encode("utf-8")).hexdigest()
+    etag_p, lastmod_p, body_p = (base.with_suffix(x) for x in (".etag", ".lastmod", ".body"))
+
+    headers: Dict[str, str] = {}
+    if body_p.exists():
+        for name, p in (("If-None-Match", etag_p), ("If-Modified-Since", lastmod_p)):
+            try:
+                headers[name] = p.read_text(encoding="utf-8")
+            except OSError:
+                pass
+
+    status, resp_headers, data = _download_ical(headers)
+    if status == 304:
+        try:
+            return body_p.read_bytes()
+        except OSError:
+            # caché borrada entre la lectura y el 304: pedimos completo
+            status, resp_headers, data = _download_ical({})
+
+    try:
+        _cache.atomic_write(body_p, data)
+        for hdr, p in (("ETag", etag_p), ("Last-Modified", lastmod_p)):
+            val = resp_headers.get(hdr)
+            if val:
+                _cache.atomic_write(p, val.encode("utf-8"))
+            elif p.exists():
+                p.unlink()
+    except OSError:
+        pass
+    return data
+
+
+def _prefilter_vevents(text: str, lo_ymd: str, hi_ymd: str) -> str:
+    """
+    Descarta bloques VEVENT cuyo rango de fechas (YYYYMMDD) cae entero fuera de
+    [lo_ymd, hi_ymd]. Conserva recurrentes (RRULE/RDATE) y bloques sin fechas
+    legibles; el filtro exacto por hora local se sigue haciendo después.
+    """
+    def _keep(m: re.Match) -> str:
+        block = m.group(0)
+        if _RECUR_RE.search(block):
+            return block
+        ms = _DTSTART_RE.search(block)
+        if not ms:
+            return block
+        if ms.group(1) > hi_ymd:
+            return ""
+        me = _DTEND_RE.search(block)
+        if me and me.group(1) < lo_ymd:
+            return ""
+        return block
+
+    return _VEVENT_RE.sub(_keep, text)
 
 
 def get_events_today_from_ics() -> List[Dict[str, Any]]:
@@ -55,11 +154,14 @@ def get_events_today_from_ics() -> List[Dict[str, Any]]:
     Devuelve eventos de HOY como lista de dicts:
     { 'summary': str, 'start': datetime, 'end': datetime }
     """
-    tz = pytz.timezone(TZ_NAME)
-    day_start, day_end = _today_window(TZ_NAME)
+    day_start, day_end = _today_window()
 
     raw = _fetch_calendar_bytes()
-    cal = ICal.from_ical(raw)  # type: ignore[arg-type]
+    # Margen de ±1 día: DTSTART/DTEND pueden venir en UTC u otra zona
+    lo_ymd = (day_start - timedelta(days=1)).strftime("%Y%m%d")
+    hi_ymd = (day_end + timedelta(days=1)).strftime("%Y%m%d")
+    text = _prefilter_vevents(raw.decode("utf-8", "replace"), lo_ymd, hi_ymd)
+    cal = ICal.from_ical(text)
 
     events_out: List[Dict[str, Any]] = []
     for comp in cal.walk():
@@ -75,15 +177,15 @@ def get_events_today_from_ics() -> List[Dict[str, Any]]:
             duration = comp.get("DURATION")
             if dtstart and duration:
                 start_val = dtstart.dt
-                start_dt = _to_local_dt(start_val, tz)
+                start_dt = _to_local_dt(start_val)
                 end_dt = start_dt + duration.dt
             else:
                 continue
         else:
             start_val = dtstart.dt
             end_val = dtend.dt
-            start_dt = _to_local_dt(start_val, tz)
-            end_dt = _to_local_dt(end_val, tz)
+            start_dt = _to_local_dt(start_val)
+            end_dt = _to_local_dt(end_val)
 
         # Intersección con hoy (en zona local)
         if (start_dt < day_end) and (end_dt > day_start):
@@ -101,24 +203,22 @@ def find_free_slots_from_events(
     events: List[Dict[str, Any]],
     min_minutes: int = STUDY_BLOCK_MIN
 ) -> List[Tuple[datetime, datetime]]:
-    tz = pytz.timezone(TZ_NAME)
-    day_start, _ = _today_window(TZ_NAME)
+    day_start, _ = _today_window()
     work_start = day_start.replace(hour=WORKDAY_START, minute=0, second=0, microsecond=0)
     work_end = day_start.replace(hour=WORKDAY_END, minute=0, second=0, microsecond=0)
 
-    # Normaliza y recorta a ventana laboral
-    intervals: List[Tuple[datetime, datetime]] = []
+    # Normaliza y recorta a ventana laboral; todo el barrido va en segundos epoch (int)
+    ws, we = int(work_start.timestamp()), int(work_end.timestamp())
+    intervals: List[Tuple[int, int]] = []
     for ev in events:
-        s = ev["start"].astimezone(tz)
-        e = ev["end"].astimezone(tz)
-        s = max(s, work_start)
-        e = min(e, work_end)
+        s = max(int(ev["start"].timestamp()), ws)
+        e = min(int(ev["end"].timestamp()), we)
         if e > s:
             intervals.append((s, e))
-    intervals.sort(key=lambda x: x[0])
+    intervals.sort()
 
     # Merge de solapamientos usando tuplas
-    merged: List[Tuple[datetime, datetime]] = []
+    merged: List[Tuple[int, int]] = []
     for s, e in intervals:
         if not merged or s > merged[-1][1]:
             merged.append((s, e))
@@ -127,23 +227,71 @@ def find_free_slots_from_events(
             merged[-1] = (last_s, max(last_e, e))
 
     # Gaps
-    free: List[Tuple[datetime, datetime]] = []
-    cursor = work_start
+    min_seconds = min_minutes * 60
+    gaps: List[Tuple[int, int]] = []
+    cursor = ws
     for s, e in merged:
-        if s > cursor:
-            gap_min = (s - cursor).total_seconds() / 60.0
-            if gap_min >= min_minutes:
-                free.append((cursor, s))
+        if s > cursor and s - cursor >= min_seconds:
+            gaps.append((cursor, s))
         cursor = max(cursor, e)
 
-    if work_end > cursor:
-        gap_min = (work_end - cursor).total_seconds() / 60.0
-        if gap_min >= min_minutes:
-            free.append((cursor, work_end))
+    if we > cursor and we - cursor >= min_seconds:
+        gaps.append((cursor, we))
 
+    # Solo los huecos finales vuelven a datetime con TZ local
+    free: List[Tuple[datetime, datetime]] = [
+        (datetime.fromtimestamp(s, _TZ), datetime.fromtimestamp(e, _TZ)) for s, e in gaps
+    ]
     return free
 
 
 def format_slot(slot: Tuple[datetime, datetime]) -> str:
     s, e = slot
     return f"{s.strftime('%H:%M')}–{e.strftime('%H:%M')}"
+
+
+# ---------- Export ICS (bloques de estudio) ----------
+# RFC 5545: líneas terminadas en CRLF; contenido 100% ASCII (UIDs hex, fechas, texto fijo)
+_ICS_HEAD = "BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//DailyStudyCompanion//EN\r\n"
+_ICS_EVENT = (
+    "BEGIN:VEVENT\r\n"
+    "UID:{base}-{i}@dailycompanion\r\n"
+    "DTSTAMP:{stamp}\r\n"
+    "DTSTART:{start}\r\n"
+    "DTEND:{end}\r\n"
+    "SUMMARY:Study block\r\n"
+    "END:VEVENT\r\n"
+)
+_ICS_TAIL = "END:VCALENDAR\r\n"
+
+
+def _fmt_dt_ics(dt: datetime) -> str:
+    # A ICS UTC
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def write_study_ics(free_slots: List[Tuple[datetime, datetime]], path: str,
+                    now: Optional[datetime] = None) -> Optional[str]:
+    """
+    Escribe un ICS básico con eventos "Study block" para los huecos recibidos.
+    Devuelve la ruta escrita o None si no se escribió.
+    """
+    if not free_slots:
+        return None
+
+    # Un DTSTAMP para todo el archivo (un único instante)
+    dtstamp = _fmt_dt_ics(now or datetime.now(timezone.utc))
+    # Un solo uuid4 por archivo; el índice basta para que los UID sean únicos
+    base = uuid.uuid4().hex
+    body = "".join(
+        _ICS_EVENT.format(base=base, i=i, stamp=dtstamp, start=_fmt_dt_ics(s), end=_fmt_dt_ics(e))
+        for i, (s, e) in enumerate(free_slots)
+    )
+
+    out = Path(path)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    # Un solo encode al final y escritura binaria (sin traducción de saltos de línea)
+    out.write_bytes((_ICS_HEAD + body + _ICS_TAIL).encode("ascii"))
+    return path
@@ -1,11 +1,14 @@
 # src/email_send.py
 from __future__ import annotations
+import atexit
 import os
 from pathlib import Path
 from typing import Iterable, Optional, List
 
 import yagmail
 
+import _bootstrap  # noqa: F401
+
 EMAIL_FROM = os.getenv("EMAIL_FROM", "")
 EMAIL_TO = os.getenv("EMAIL_TO", "")
 SUBJECT_PREFIX = os.getenv("EMAIL_SUBJECT_PREFIX", "[Daily Companion]")
@@ -14,6 +17,32 @@ EMAIL_EMBED_MODE = (os.getenv("EMAIL_EMBED_MODE", "attachment") or "attachment")
 REPORT_PUBLIC_URL = (os.getenv("REPORT_PUBLIC_URL", "") or "").strip()
 
 
+# Conexión SMTP autenticada reutilizada entre envíos del mismo proceso
+_yag: Optional[yagmail.SMTP] = None
+
+
+def _get_smtp() -> yagmail.SMTP:
+    global _yag
+    if _yag is None:
+        _yag = yagmail.SMTP(user=EMAIL_FROM, password=GMAIL_APP_PASSWORD)
+    return _yag
+
+
+def _drop_smtp() -> None:
+    """Descarta la conexión (p.ej. tras un error) para reautenticar en el próximo envío."""
+    global _yag
+    if _yag is not None:
+        try:
+            _yag.close()
+        except Exception:
+            pass
+        _yag = None
+
+
+# Un solo hook: al salir se cierra la conexión vigente (si la hay), no cada objeto creado
+atexit.register(_drop_smtp)
+
+
 def _ensure_list(x: Optional[Iterable[str]]) -> List[str]:
     return list(x) if x else []
 
@@ -54,8 +83,7 @@ def send_email(
         # sin adjuntos en linkonly
 
     elif mode == "inline":
-        html_text = Path(html_path).read_text(encoding="utf-8")
-        body = html_text + (extra_html or "")
+        body = Path(html_path).read_bytes().decode("utf-8") + (extra_html or "")
         contents.append(yagmail.inline(body))
         # sin adjuntos
 
@@ -74,7 +102,7 @@ def send_email(
         if html_path not in final_attachments:
             final_attachments.insert(0, html_path)
 
-    yag = yagmail.SMTP(user=EMAIL_FROM, password=GMAIL_APP_PASSWORD)
+    yag = _get_smtp()
     try:
         yag.send(
             to=to_list,
@@ -82,9 +110,10 @@ def send_email(
             contents=contents,
             attachments=final_attachments,
         )
-        print(f"[email] Enviado a {', '.join(to_list)} (mode={EMAIL_EMBED_MODE})")
-    finally:
-        yag.close()
+    except Exception:
+        _drop_smtp()
+        raise
+    print(f"[email] Enviado a {', '.join(to_list)} (mode={EMAIL_EMBED_MODE})")
 
 
 if __name__ == "__main__":
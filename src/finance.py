@@ -1,15 +1,32 @@
 # src/finance.py
 from __future__ import annotations
 
+import functools
+import html
 import io
+import multiprocessing
 import os
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from pathlib import Path, PurePosixPath
+from typing import Dict, List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
-from dotenv import load_dotenv
+import requests
+from requests.adapters import HTTPAdapter
 
-load_dotenv()
+import _bootstrap  # noqa: F401
+import _cache
+
+try:
+    # Parser CSV de Arrow (C++, multihilo, tipos explícitos): mucho más liviano que read_csv
+    import pyarrow as pa
+    from pyarrow import csv as pacsv
+except ImportError:
+    pa = None  # type: ignore[assignment]
 
 # -------- Config --------
 RAW_TICKERS = [
@@ -19,32 +36,84 @@ RAW_TICKERS = [
 ]
 PRICE_WINDOW_DAYS = int(os.getenv("PRICE_WINDOW_DAYS", "14"))
 CHARTS_DIR = os.getenv("CHARTS_DIR", "data/processed/charts")
+CHART_FORMAT = (os.getenv("CHART_FORMAT", "png") or "png").lower()  # png / webp / svg
+CHART_DPI = 110
+# Por debajo de este número de gráficas se renderiza en serie: cada worker
+# re-importa matplotlib y eso cuesta más que unas pocas figuras pequeñas
+_PLOT_PROCESS_MIN = 12
+
+# Las rutas de las imágenes se escriben relativas al HTML del reporte
+_REPORT_OUT_PATH = os.getenv("REPORT_OUT_PATH", "data/processed/daily_report.html")
+_REPORT_DIR = Path(_REPORT_OUT_PATH).parent
+
+# Opciones de codificación: PNG con zlib nivel 1 (el default 6 domina el tiempo
+# de guardado), WebP con calidad 80 (más rápido y más liviano)
+_CHART_SAVE_KW: Dict[str, Dict] = {
+    "png": {"pil_kwargs": {"compress_level": 1}},
+    "webp": {"pil_kwargs": {"quality": 80}},
+}
+if CHART_FORMAT not in _CHART_SAVE_KW and CHART_FORMAT != "svg":
+    CHART_FORMAT = "png"
 
 # Alias (por si el .env trae índices como ^GSPC)
 TICKER_ALIASES = {"^GSPC": "SPY"}
 
+# Sesión compartida: keep-alive + pool para descargar varios tickers en paralelo
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=16))
+
+if pa is not None:
+    _PA_READ = pacsv.ReadOptions(use_threads=True)
+    _PA_CONVERT = pacsv.ConvertOptions(column_types={
+        "Date": pa.date32(),
+        # float32 alcanza para precios de reporte y reduce a la mitad la memoria
+        "Open": pa.float32(), "High": pa.float32(), "Low": pa.float32(), "Close": pa.float32(),
+        "Volume": pa.int64(),  # int32 se desborda con volúmenes > 2^31
+    })
+
+STOOQ_CSV_URL = "https://stooq.com/q/d/l/"
+
+# Caché incremental de CSVs de Stooq (los días cerrados no cambian)
+_STOOQ_CACHE_DIR = _cache.CACHE_ROOT / "stooq"
+STOOQ_CACHE_TTL_S = 6 * 3600
+
 # -------- Helpers --------
-def _start(days: int) -> datetime:
-    # margen extra para asegurar puntos suficientes
-    return datetime.utcnow() - timedelta(days=days * 2)
+def _start(days: int, now: datetime) -> datetime:
+    # margen extra para asegurar puntos suficientes (now en UTC, tz-aware)
+    return now - timedelta(days=days * 2)
 
-def _clean(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy()
+def _clean(df: pd.DataFrame, *, copy: bool = False) -> pd.DataFrame:
+    """
+    Índice datetime en UTC, orden ascendente, sin filas vacías. Opera in-place:
+    los fetchers pasan frames recién parseados que nadie más referencia.
+    """
+    if copy:
+        df = df.copy()
     if not isinstance(df.index, pd.DatetimeIndex):
         df.index = pd.to_datetime(df.index, utc=True, errors="coerce")
-    df = df.sort_index()
-    return df.dropna(how="all")
+    elif df.index.tz is None:
+        # pandas-datareader entrega índice naive; CSV y caché, UTC: se unifica
+        # para que _to_panel pueda concatenar tickers de fuentes mezcladas
+        df.index = df.index.tz_localize("UTC")
+    else:
+        df.index = df.index.tz_convert("UTC")
+    df.sort_index(inplace=True)
+    df.dropna(how="all", inplace=True)
+    return df
 
-def _select_close(df: pd.DataFrame) -> Optional[pd.Series]:
-    """Devuelve la mejor serie de cierre disponible."""
+def _find_close(df: pd.DataFrame) -> Optional[pd.Series]:
     for c in ["Close", "Adj Close", "Adj Close*", "close"]:
         if c in df.columns:
-            s = pd.to_numeric(df[c], errors="coerce").dropna()
+            col = df[c]
+            # Stooq ya entrega floats: solo coercemos columnas no numéricas
+            if not pd.api.types.is_numeric_dtype(col):
+                col = pd.to_numeric(col, errors="coerce")
+            s = col.dropna()
             if not s.empty:
                 return s
     num = df.select_dtypes(include="number")
     if not num.empty:
-        s = pd.to_numeric(num.iloc[:, 0], errors="coerce").dropna()
+        s = num.iloc[:, 0].dropna()
         if not s.empty:
             return s
     return None
@@ -60,154 +129,399 @@ def _stooq_candidates(tk: str) -> List[str]:
     return cands
 
 # -------- Fetchers --------
-def _fetch_stooq_pdr(tk: str, start: datetime) -> Optional[pd.DataFrame]:
-    """Intenta Stooq vía pandas-datareader."""
+def _fetch_stooq_pdr(syms: List[str], start: datetime) -> Optional[pd.DataFrame]:
+    """Intenta Stooq vía pandas-datareader (syms = _stooq_candidates(tk))."""
     try:
         from pandas_datareader import data as pdr  # type: ignore
     except Exception:
         return None
 
-    for sym in _stooq_candidates(tk):
+    for sym in syms:
         try:
-            df = pdr.DataReader(sym, "stooq", start=start.date())
+            df = pdr.DataReader(sym, "stooq", start=start.date(), session=_SESSION)
             if isinstance(df, pd.DataFrame) and not df.empty:
-                # Stooq llega descendente
-                return _clean(df.sort_index())
+                # Stooq llega descendente (_clean ordena)
+                df = _clean(df)
+                _store_cached(sym.lower(), df)
+                return df
         except Exception:
             continue
     return None
 
-def _fetch_stooq_csv(tk: str, start: datetime, end: Optional[datetime] = None) -> Optional[pd.DataFrame]:
+def _read_csv(data: bytes) -> pd.DataFrame:
+    """CSV (bytes crudos) -> DataFrame vía Arrow (tipado); si no está o falla, pandas."""
+    if pa is not None:
+        try:
+            table = pacsv.read_csv(
+                pa.BufferReader(data),
+                read_options=_PA_READ,
+                convert_options=_PA_CONVERT,
+            )
+            return table.to_pandas(date_as_object=False)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            pass
+    return pd.read_csv(io.BytesIO(data))
+
+def _parse_stooq_csv(data: bytes) -> Optional[pd.DataFrame]:
+    try:
+        df = _read_csv(data)
+    except Exception:
+        return None
+    if not isinstance(df, pd.DataFrame) or df.empty:
+        return None
+    # Esperamos columnas: Date, Open, High, Low, Close, Volume
+    if "Date" in df.columns:
+        df["Date"] = pd.to_datetime(df["Date"], utc=True, errors="coerce")
+        df = df.set_index("Date")
+    df = _clean(df)
+    return df if not df.empty else None
+
+def _load_cached(sym: str) -> Tuple[Optional[pd.DataFrame], float]:
+    """(DataFrame cacheado, antigüedad en segundos) o (None, inf)."""
+    path = _STOOQ_CACHE_DIR / f"{sym}.csv"
+    try:
+        age = time.time() - path.stat().st_mtime
+        return _parse_stooq_csv(path.read_bytes()), age
+    except OSError:
+        return None, float("inf")
+
+def _fresh_cached(syms: List[str], start: datetime) -> Optional[pd.DataFrame]:
+    """Ventana desde la caché si es reciente (< TTL) y cubre start; si no, None."""
+    start_ts = pd.Timestamp(start).tz_convert("UTC")
+    for s in syms:
+        df, age = _load_cached(s.lower())
+        if df is not None and age < STOOQ_CACHE_TTL_S and df.index.min() <= start_ts + pd.Timedelta(days=7):
+            return df.loc[start_ts:]
+    return None
+
+def _store_cached(sym: str, df: pd.DataFrame) -> None:
+    # Mismo formato que el CSV de Stooq (Date=YYYY-MM-DD) para reutilizar el parser
+    try:
+        data = df.to_csv(index_label="Date", date_format="%Y-%m-%d").encode("utf-8")
+        _cache.atomic_write(_STOOQ_CACHE_DIR / f"{sym}.csv", data)
+    except OSError:
+        pass
+
+def _stooq_url_tpl(end: datetime) -> str:
+    """Plantilla de URL con d2 ya formateado; quedan {s} y {d1}."""
+    return f"{STOOQ_CSV_URL}?s={{s}}&i=d&d1={{d1}}&d2={end:%Y%m%d}"
+
+def _fetch_stooq_csv(
+    syms: List[str],
+    start: datetime,
+    url_tpl: Optional[str] = None,
+    session: requests.Session = _SESSION,
+) -> Optional[pd.DataFrame]:
     """
     Descarga directa CSV de Stooq:
     https://stooq.com/q/d/l/?s=spy.us&i=d&d1=YYYYMMDD&d2=YYYYMMDD
+    Con caché en disco: si es reciente se usa tal cual; si no, solo se piden
+    las filas desde el último día cacheado.
     """
-    import requests
+    if url_tpl is None:
+        url_tpl = _stooq_url_tpl(datetime.now(timezone.utc))
+    start_ts = pd.Timestamp(start).tz_convert("UTC")
+    start_ymd = start.strftime("%Y%m%d")
 
-    if end is None:
-        end = datetime.utcnow()
+    # en la URL va en minúsculas, p.ej., spy.us
+    cands = [sym.lower() for sym in syms]
 
-    for sym in _stooq_candidates(tk):
-        s = sym.lower()  # en la URL va en minúsculas, p.ej., spy.us
-        d1 = start.strftime("%Y%m%d")
-        d2 = end.strftime("%Y%m%d")
-        url = f"https://stooq.com/q/d/l/?s={s}&i=d&d1={d1}&d2={d2}"
-        text: Optional[str] = None
+    # El símbolo que ya tiene caché válida (cubre la ventana) va primero
+    cached: Optional[pd.DataFrame] = None
+    for s in cands:
+        df, age = _load_cached(s)
+        if df is not None and df.index.min() <= start_ts + pd.Timedelta(days=7):
+            if age < STOOQ_CACHE_TTL_S:
+                return df.loc[start_ts:]
+            cached = df
+            cands.remove(s)
+            cands.insert(0, s)
+            break
+
+    for i, s in enumerate(cands):
+        inc = cached if i == 0 else None
+        # Se re-descarga el último día cacheado por si quedó parcial
+        d1 = start_ymd
+        if inc is not None:
+            d1 = max(start, inc.index.max().to_pydatetime()).strftime("%Y%m%d")
+        url = url_tpl.format(s=s, d1=d1)
+        body: Optional[bytes] = None
         try:
-            r = requests.get(url, timeout=20)
+            r = session.get(url, timeout=20)
             r.raise_for_status()
-            text = r.text or ""
+            body = r.content
         except Exception:
-            text = None
+            body = None
 
-        if not text or text.strip().startswith("<!DOCTYPE") or text.strip().startswith("404"):
-            continue
+        # Páginas HTML/404 se descartan mirando solo los primeros bytes (sin decodificar)
+        df = None
+        if body:
+            head = body[:16].lstrip()
+            if not head.startswith((b"<!DOCTYPE", b"404")):
+                df = _parse_stooq_csv(body)
 
-        try:
-            df = pd.read_csv(io.StringIO(text))
-        except Exception:
+        if df is None:
+            if inc is not None:
+                return inc.loc[start_ts:]  # sin filas nuevas (o sin red): lo cacheado
             continue
 
-        if isinstance(df, pd.DataFrame) and not df.empty:
-            # Esperamos columnas: Date, Open, High, Low, Close, Volume
-            if "Date" in df.columns:
-                df["Date"] = pd.to_datetime(df["Date"], utc=True, errors="coerce")
-                df = df.set_index("Date")
-            df = _clean(df)
-            if not df.empty:
-                return df
+        if inc is not None:
+            df = pd.concat([inc, df])
+            df = df[~df.index.duplicated(keep="last")].sort_index()
+        df = df.loc[start_ts:]
+        _store_cached(s, df)
+        return df
     return None
 
+def _fetch_one(syms: List[str], start: datetime, url_tpl: str) -> Optional[pd.DataFrame]:
+    # Caché reciente antes que cualquier red (incluido pandas-datareader)
+    df = _fresh_cached(syms, start)
+    if df is not None:
+        return df
+    df = _fetch_stooq_pdr(syms, start)
+    if df is None or df.empty:
+        df = _fetch_stooq_csv(syms, start, url_tpl)
+    return df
+
 # -------- API --------
-def fetch_prices(tickers: Optional[List[str]] = None) -> Dict[str, pd.DataFrame]:
+_PANEL_LEVELS = ["ticker", "field"]
+
+def _to_panel(frames: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """dict[ticker] -> DataFrame ancho con columnas MultiIndex (ticker, field)."""
+    if not frames:
+        return pd.DataFrame(columns=pd.MultiIndex.from_arrays([[], []], names=_PANEL_LEVELS))
+    panel = pd.concat(frames, axis=1, names=_PANEL_LEVELS).sort_index()
+    # OHLC en float32 (pandas-datareader y read_csv entregan float64)
+    f64 = panel.columns[(panel.dtypes == np.float64).to_numpy()]
+    if len(f64):
+        panel[f64] = panel[f64].astype(np.float32)
+    # Los tickers se repiten por cada campo: nivel categórico
+    panel.columns = panel.columns.set_levels(
+        panel.columns.levels[0].astype("category"), level="ticker"
+    )
+    return panel
+
+def _tickers(panel: pd.DataFrame) -> List[str]:
+    return list(panel.columns.get_level_values("ticker").unique())
+
+def as_dict(panel: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """Compatibilidad: panel (ticker, field) -> dict[ticker] -> DataFrame OHLCV."""
+    return {t: panel[t].dropna(how="all").dropna(axis=1, how="all") for t in _tickers(panel)}
+
+def fetch_prices(tickers: Optional[List[str]] = None, now: Optional[datetime] = None) -> pd.DataFrame:
     """
-    Devuelve dict[ticker] -> DataFrame (OHLCV). Orden de intentos:
+    Devuelve un panel ancho: índice=fecha, columnas MultiIndex (ticker, field) con OHLCV.
+    Orden de intentos por ticker:
       1) pandas-datareader/Stooq
       2) descarga directa CSV de Stooq
-    Omite tickers sin datos (silencioso).
+    Omite tickers sin datos (silencioso). `as_dict(panel)` da la forma anterior.
+    `now` (UTC, tz-aware) fija la ventana para toda la corrida; por defecto, ahora.
     """
     if tickers is None:
         tickers = RAW_TICKERS
-    start = _start(PRICE_WINDOW_DAYS)
+    if not tickers:
+        return _to_panel({})
+    if now is None:
+        now = datetime.now(timezone.utc)
+    start = _start(PRICE_WINDOW_DAYS, now)
+    # Candidatos y plantilla de URL una vez por corrida (no por fetcher/reintento)
+    url_tpl = _stooq_url_tpl(now)
+    syms = {raw: _stooq_candidates(TICKER_ALIASES.get(raw, raw)) for raw in tickers}
 
+    # Descargas en paralelo (I/O de red); el alias se resuelve fuera del worker
+    got: Dict[str, Optional[pd.DataFrame]] = {}
+    with ThreadPoolExecutor(max_workers=min(16, len(tickers))) as ex:
+        futs = {ex.submit(_fetch_one, syms[raw], start, url_tpl): raw for raw in tickers}
+        for f in as_completed(futs):
+            try:
+                got[futs[f]] = f.result()
+            except Exception:
+                got[futs[f]] = None
+
+    # Mantiene el orden de `tickers`
     out: Dict[str, pd.DataFrame] = {}
     for raw in tickers:
-        tk = TICKER_ALIASES.get(raw, raw)
-        df = _fetch_stooq_pdr(tk, start) or _fetch_stooq_csv(tk, start)
+        df = got.get(raw)
         if df is not None and not df.empty:
             out[raw] = df
-    return out
+    return _to_panel(out)
+
+# Memo del panel de cierres por objeto panel (id -> DataFrame): basic_stats y
+# plot_prices reciben el mismo panel. La entrada se borra sola cuando el panel
+# se libera. No se usa df.attrs: pandas copia attrs (deepcopy) a cada frame derivado.
+_CLOSE_MEMO: Dict[int, pd.DataFrame] = {}
+
+def _build_close_panel(panel: pd.DataFrame) -> pd.DataFrame:
+    """
+    Panel ancho de cierres: columnas=tickers, índice=fecha. Cada ticker aporta
+    sus últimos PRICE_WINDOW_DAYS puntos (NaN donde otro ticker no cotizó).
+    """
+    if panel.empty:
+        return pd.DataFrame()
+    key = id(panel)
+    hit = _CLOSE_MEMO.get(key)
+    if hit is not None:
+        return hit
+
+    tickers = _tickers(panel)
+    if "Close" in panel.columns.get_level_values("field"):
+        closes = panel.xs("Close", level="field", axis=1)
+        closes = closes.loc[:, [pd.api.types.is_numeric_dtype(closes[t]) for t in closes.columns]]
+    else:
+        closes = pd.DataFrame(index=panel.index)
+    # Tickers sin "Close" numérico: búsqueda de columna por ticker (Adj Close, etc.)
+    extra = {}
+    for t in tickers:
+        if t not in closes.columns:
+            s = _find_close(panel[t].dropna(how="all"))
+            if s is not None:
+                extra[t] = s
+    if extra:
+        closes = pd.concat([closes, pd.DataFrame(extra)], axis=1)
+    closes = closes.reindex(columns=[t for t in tickers if t in closes.columns])
+
+    # Ventana por ticker: conserva los últimos N valores válidos de cada columna
+    valid = closes.notna()
+    remaining = valid.iloc[::-1].cumsum().iloc[::-1]
+    closes = closes.where(valid & (remaining <= PRICE_WINDOW_DAYS)).dropna(how="all")
+    # Ticker sin ningún cierre válido: se omite (como el `continue` original), así
+    # _stats_kernel nunca recibe columnas vacías
+    closes = closes.dropna(axis=1, how="all")
+
+    _CLOSE_MEMO[key] = closes
+    weakref.finalize(panel, _CLOSE_MEMO.pop, key, None)
+    return closes
+
+_STAT_KEYS = ("last", "mean", "std", "min", "max", "pct_change")
 
-def basic_stats(prices: Dict[str, pd.DataFrame]) -> Dict[str, Dict[str, float]]:
+def _stats_kernel(a: np.ndarray) -> np.ndarray:
+    """
+    a: (fechas, tickers) float64 con NaN donde no hay dato; cada columna tiene al
+    menos un valor. Devuelve (6, tickers) en el orden de _STAT_KEYS.
+    """
+    valid = ~np.isnan(a)
+    cols = np.arange(a.shape[1])
+    first = a[valid.argmax(axis=0), cols]
+    last = a[a.shape[0] - 1 - valid[::-1].argmax(axis=0), cols]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pct = np.where(first != 0, (last - first) / first * 100.0, 0.0)
+    return np.stack([
+        last,
+        np.nanmean(a, axis=0),
+        np.nanstd(a, axis=0),  # ddof=0
+        np.nanmin(a, axis=0),
+        np.nanmax(a, axis=0),
+        pct,
+    ])
+
+def basic_stats(prices: pd.DataFrame) -> Dict[str, Dict[str, float]]:
     """
     Calcula estadísticas por ticker usando la serie de cierre seleccionada.
     Retorna: dict[ticker] -> {last, mean, std, min, max, pct_change}
     """
-    stats: Dict[str, Dict[str, float]] = {}
-    for t, df in prices.items():
-        s = _select_close(df)
-        if s is None or s.empty:
-            continue
-        s = s.iloc[-PRICE_WINDOW_DAYS:] if len(s) > PRICE_WINDOW_DAYS else s
-        if s.empty:
-            continue
+    panel = _build_close_panel(prices)
+    if panel.empty:
+        return {}
 
-        first, last = float(s.iloc[0]), float(s.iloc[-1])
-        pct = ((last - first) / first * 100.0) if first else 0.0
-        stats[t] = {
-            "last": last,
-            "mean": float(s.mean()),
-            "std": float(s.std(ddof=0)),
-            "min": float(s.min()),
-            "max": float(s.max()),
-            "pct_change": pct,
-        }
-    return stats
-
-def plot_prices(prices: Dict[str, pd.DataFrame]) -> List[str]:
-    """
-    Genera PNG por ticker con la serie de cierre seleccionada.
-    Devuelve lista de rutas a imágenes (absolutas).
-    """
+    # Todas las reducciones en NumPy sobre el bloque completo (NaN se ignoran)
+    out = _stats_kernel(panel.to_numpy(dtype=np.float64)).T.tolist()
+    return {str(t): dict(zip(_STAT_KEYS, row)) for t, row in zip(panel.columns, out)}
+
+@functools.cache
+def _mpl():
+    """Importa matplotlib (backend Agg) una sola vez; las llamadas siguientes son un lookup."""
     import matplotlib  # type: ignore
     matplotlib.use("Agg")
-    import matplotlib.pyplot as plt  # type: ignore
-    from pathlib import Path
+    # Figure + canvas Agg directos: sin la máquina de estado global de pyplot
+    from matplotlib.backends.backend_agg import FigureCanvasAgg  # type: ignore
+    from matplotlib.figure import Figure  # type: ignore
+
+    return Figure, FigureCanvasAgg
+
+@functools.cache
+def _chart_axes():
+    """Una Figure + Axes por proceso, reutilizada entre tickers (evita rearmar estilo/fuentes)."""
+    Figure, FigureCanvasAgg = _mpl()
+    fig = Figure(figsize=(8, 3))
+    FigureCanvasAgg(fig)
+    return fig, fig.subplots()
+
+def _render_png(t: str, xs: np.ndarray, ys: np.ndarray, outdir: str) -> str:
+    """Dibuja y guarda la gráfica (corre en un proceso worker; arrays NumPy, picklables)."""
+    fig, ax = _chart_axes()
+    ax.clear()
+    ax.plot(xs, ys, linewidth=1.6)
+    d0, d1 = np.datetime_as_string(xs[[0, -1]], unit="D")
+    ax.set_title(f"{t} — {len(ys)} pts ({d0} → {d1})")
+    ax.set_xlabel("")
+    ax.set_ylabel("Close")
+    fig.tight_layout()
 
+    out_path = os.path.join(outdir, f"{t}_close.{CHART_FORMAT}")
+    fig.savefig(out_path, dpi=CHART_DPI, format=CHART_FORMAT, **_CHART_SAVE_KW[CHART_FORMAT])
+    return out_path
+
+def _render_svg(xs: np.ndarray, ys: np.ndarray, title: str) -> str:
+    """Línea de cierre como SVG plano (sin matplotlib): y normalizada a 0..100."""
+    lo, hi = float(ys.min()), float(ys.max())
+    span = (hi - lo) or 1.0
+    py = 100.0 - (ys - lo) / span * 100.0
+    points = " ".join(f"{i},{y:.1f}" for i, y in enumerate(py.tolist()))
+    width = max(len(ys) - 1, 1)
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width} 100" '
+        f'preserveAspectRatio="none" width="100%" height="160">'
+        f"<title>{html.escape(title)}</title>"
+        f'<polyline points="{points}" fill="none" stroke="#1f77b4" stroke-width="1.6" '
+        f'vector-effect="non-scaling-stroke"/></svg>'
+    )
+
+def _write_svg(t: str, xs: np.ndarray, ys: np.ndarray, outdir: str) -> str:
+    d0, d1 = np.datetime_as_string(xs[[0, -1]], unit="D")
+    out_path = Path(outdir) / f"{t}_close.svg"
+    out_path.write_text(_render_svg(xs, ys, f"{t} — {len(ys)} pts ({d0} → {d1})"), encoding="utf-8")
+    return str(out_path)
+
+def plot_prices(prices: pd.DataFrame) -> List[str]:
+    """
+    Genera una imagen (PNG, WebP o SVG según CHART_FORMAT) por ticker con la serie de cierre.
+    Devuelve lista de rutas a imágenes (absolutas).
+    Con muchos tickers el render (CPU: rasterizado + zlib) se reparte en procesos.
+    """
     outdir = Path(CHARTS_DIR)
     outdir.mkdir(parents=True, exist_ok=True)
-    imgs: List[str] = []
-
-    for t, df in prices.items():
-        s = _select_close(df)
-        if s is None or s.empty:
-            continue
 
-        # recorta ventana
-        s = s.iloc[-PRICE_WINDOW_DAYS:] if len(s) > PRICE_WINDOW_DAYS else s
+    jobs = []
+    panel = _build_close_panel(prices)
+    for t in panel.columns:
+        s = panel[t].dropna()
         if s.empty:
             continue
 
-        # normaliza índice y valores (silencia ArrayLike warnings)
-        xs = pd.to_datetime(s.index, errors="coerce").to_pydatetime()
-        ys = s.astype(float).values
-        xs_list = list(xs)                         
-        ys_list = [float(v) for v in ys.tolist()] 
-
-        fig = plt.figure(figsize=(8, 3))
-        plt.plot(xs_list, ys_list, linewidth=1.6)
-        plt.title(f"{t} — {len(s)} pts ({xs[0].date()} → {xs[-1].date()})")
-        plt.xlabel("")
-        plt.ylabel("Close")
-        plt.tight_layout()
-
-        out_path = outdir / f"{t}_close.png"
-        fig.savefig(out_path, dpi=140)
-        plt.close(fig)
-
-        report_out = os.getenv("REPORT_OUT_PATH", "data/processed/daily_report.html")
-        report_dir = Path(report_out).parent
-        rel = os.path.relpath(out_path, report_dir)
-        imgs.append(rel.replace(os.sep, "/")) 
-
-    return imgs
+        # matplotlib trabaja directo con arrays NumPy (sin listas de objetos Python)
+        xs = s.index.to_numpy(dtype="datetime64[ns]")
+        ys = s.to_numpy(dtype=np.float64)
+        jobs.append((t, xs, ys, str(outdir)))
+    if not jobs:
+        return []
+
+    workers = min(len(jobs), os.cpu_count() or 1)
+    paths: List[str] = []
+    if CHART_FORMAT == "svg":
+        # SVG es solo formateo de strings: ni matplotlib ni procesos worker
+        paths = [_write_svg(*job) for job in jobs]
+    elif workers > 1 and len(jobs) >= _PLOT_PROCESS_MIN:
+        try:
+            # spawn, no fork: main.py tiene hilos vivos (digest en HTTPS) y
+            # hacer fork con hilos puede dejar locks tomados en el hijo
+            ctx = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as ex:
+                paths = list(ex.map(_render_png, *zip(*jobs)))
+        except Exception:
+            paths = []  # sin procesos disponibles (sandbox, etc.): en serie
+    if not paths:
+        paths = [_render_png(*job) for job in jobs]
+
+    # Todas las imágenes viven en outdir: el prefijo relativo se calcula una vez
+    rel_prefix = PurePosixPath(os.path.relpath(outdir, _REPORT_DIR).replace(os.sep, "/"))
+    return [str(rel_prefix / os.path.basename(p)) for p in paths]
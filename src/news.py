@@ -1,19 +1,35 @@
 # src/news.py
 from __future__ import annotations
 
+import calendar
+import functools
+import hashlib
+import io
 import os
 import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from email.utils import mktime_tz, parsedate_tz
 from time import struct_time
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 from urllib.parse import urlparse
 
 import requests
 import feedparser
 import yaml
-from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-load_dotenv()
+import _bootstrap  # noqa: F401
+import _cache
+
+try:
+    # libxml2 en C, en streaming: solo se extraen los campos que usamos
+    from lxml import etree
+except ImportError:
+    etree = None  # type: ignore[assignment]
 
 CONFIG_PATH = os.getenv("NEWS_CONFIG_PATH", "config/news.yml")
 
@@ -90,10 +106,59 @@ LIMIT_PER_TOPIC: int = int(CFG["news"].get("limit", 6))
 MAX_AGE_HOURS: int = int(CFG["news"].get("max_age_hours", 36))
 WL: List[str] = [d.lower() for d in CFG["news"].get("domain_whitelist", [])]
 BL: List[str] = [d.lower() for d in CFG["news"].get("domain_blacklist", [])]
+# Para filtrar hosts: igualdad exacta (hash) o subdominio (endswith con tupla, en C)
+WL_SET: frozenset = frozenset(WL)
+WL_SUFFIX: Tuple[str, ...] = tuple("." + d for d in WL_SET)
+BL_SET: frozenset = frozenset(BL)
+BL_SUFFIX: Tuple[str, ...] = tuple("." + d for d in BL_SET)
+
+def _valid_pattern(pat: str) -> bool:
+    # Se valida ya envuelto: así también entra en la alternación sin romperla
+    try:
+        re.compile(f"(?:{pat})")
+        return True
+    except (re.error, TypeError):
+        # Si hay un patrón mal escrito en YAML, lo ignoramos
+        return False
+
+def _topic_unions(patterns: Dict[str, List[str]]) -> Dict[str, str]:
+    """tópico -> alternación de sus patrones válidos."""
+    out: Dict[str, str] = {}
+    for topic, pats in patterns.items():
+        good = [p for p in (pats or []) if _valid_pattern(p)]
+        if good:
+            out[topic] = "|".join(f"(?:{p})" for p in good)
+    return out
+
+def _compile_master(unions: Dict[str, str]) -> Tuple[re.Pattern | None, Dict[str, str]]:
+    """
+    Una sola regex para todos los tópicos, anclada al inicio: una alternativa por
+    tópico con lookahead + grupo vacío con nombre. SRE prueba las alternativas en
+    orden, así que gana el primer tópico que coincide en cualquier parte (igual
+    que el loop), y `m.lastgroup` dice cuál fue. None si no compila (p. ej. grupos
+    con nombre repetidos entre tópicos).
+    """
+    if not unions:
+        return None, {}
+    names = {f"t{i}": topic for i, topic in enumerate(unions)}
+    alts = "|".join(
+        rf"(?=[\s\S]*?(?:{union}))(?P<{g}>)" for g, union in zip(names, unions.values())
+    )
+    try:
+        return re.compile(rf"\A(?:{alts})", re.IGNORECASE), names
+    except re.error:
+        return None, {}
+
+_TOPIC_UNIONS = _topic_unions(TOPIC_PATTERNS)
+TOPIC_MASTER, _GROUP_TOPIC = _compile_master(_TOPIC_UNIONS)
+# Respaldo por tópico (solo se usa si la regex maestra no compiló)
+TOPIC_REGEX: Dict[str, re.Pattern] = {
+    topic: re.compile(union, re.IGNORECASE) for topic, union in _TOPIC_UNIONS.items()
+}
 
 # ---------------- RSS sources (curados) ----------------
 # Solo medios globales de negocio/tech/AI
-RSS_SOURCES: List[Tuple[str, str]] = [
+_CURATED_SOURCES: Tuple[Tuple[str, str], ...] = (
     # WSJ
     ("wsj.com", "https://feeds.a.dj.com/rss/RSSMarketsMain.xml"),
     ("wsj.com", "https://feeds.a.dj.com/rss/WSJcomUSBusiness.xml"),
@@ -118,15 +183,7 @@ RSS_SOURCES: List[Tuple[str, str]] = [
     ("forbes.com", "https://www.forbes.com/money/feed/"),
     # Yahoo Finance
     ("finance.yahoo.com", "https://finance.yahoo.com/news/rssindex"),
-]
-
-# Filtrar por whitelist/blacklist si están definidas
-RSS_SOURCES = [
-    (dom, url)
-    for dom, url in RSS_SOURCES
-    if (not WL or any(w in dom or w in url for w in WL))
-    and (not BL or not any(b in dom or b in url for b in BL))
-]
+)
 
 HEADERS = {
     "User-Agent": (
@@ -136,68 +193,268 @@ HEADERS = {
     "Accept": "application/rss+xml,text/xml,*/*",
 }
 
+# Sesión compartida entre hilos: keep-alive/TLS reutilizados por host (WSJ, NYT, ...);
+# reintentos cortos solo ante fallas de conexión (read=0: un feed colgado no se
+# reintenta, así no bloquea fetch_news más de un timeout)
+_SESSION = requests.Session()
+_SESSION.headers.update(HEADERS)
+_ADAPTER = HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=32,
+    max_retries=Retry(total=2, read=0, backoff_factor=0.3),
+)
+_SESSION.mount("https://", _ADAPTER)
+_SESSION.mount("http://", _ADAPTER)
+
+# Caché de feeds en disco: GET condicional (ETag/Last-Modified) y, dentro del TTL,
+# ni siquiera se consulta al servidor. Se guarda el resultado ya parseado.
+_RSS_CACHE_DIR = _cache.CACHE_ROOT / "rss"
+RSS_CACHE_TTL_S = int(os.getenv("RSS_CACHE_TTL_SECONDS", str(15 * 60)))
+
 # ---------------- Utilidades ----------------
 
+@functools.lru_cache(maxsize=4096)
 def _host(link: str) -> str:
     try:
         return urlparse(link).netloc.lower()
     except Exception:
         return ""
 
-def _fetch_feed(url: str) -> feedparser.FeedParserDict:
-    r = requests.get(url, headers=HEADERS, timeout=20)
+def _domain_match(host: str, exact: frozenset, suffix: Tuple[str, ...]) -> bool:
+    return host in exact or host.endswith(suffix)
+
+def _rss_sources() -> Tuple[Tuple[str, str], ...]:
+    """Fuentes curadas filtradas por whitelist/blacklist (dominio declarado o host de la URL)."""
+    def allowed(dom: str, url: str) -> bool:
+        hosts = (dom, _host(url))
+        if WL_SET and not any(_domain_match(h, WL_SET, WL_SUFFIX) for h in hosts):
+            return False
+        return not (BL_SET and any(_domain_match(h, BL_SET, BL_SUFFIX) for h in hosts))
+    return tuple((dom, url) for dom, url in _CURATED_SOURCES if allowed(dom, url))
+
+RSS_SOURCES: Tuple[Tuple[str, str], ...] = _rss_sources()
+
+# ---------------- Parseo de feeds ----------------
+# Entrada normalizada (dict plano, serializable a JSON): title, link, published,
+# published_parsed (tupla de 9 ints en UTC, como struct_time, o None), summary,
+# source, author
+
+_ATOM = "{http://www.w3.org/2005/Atom}"
+_ENTRY_TAGS = ("item", "{http://purl.org/rss/1.0/}item", f"{_ATOM}entry")
+
+def _parse_date(s: str) -> struct_time | None:
+    """RFC 822 (RSS pubDate) o ISO 8601 (Atom / dc:date) -> struct_time UTC."""
+    s = s.strip()
+    if not s:
+        return None
+    tt = parsedate_tz(s)
+    if tt is not None:
+        return time.gmtime(mktime_tz(tt))
+    try:
+        dt = datetime.fromisoformat(s)
+    except ValueError:
+        return None
+    return time.gmtime(dt.timestamp()) if dt.tzinfo else dt.timetuple()
+
+def _parse_feed_lxml(body: bytes) -> List[Dict[str, Any]]:
+    """RSS 2.0 / RSS 1.0 / Atom vía iterparse; cada entrada se libera al leerla."""
+    entries: List[Dict[str, Any]] = []
+    ctx = etree.iterparse(
+        io.BytesIO(body), events=("end",), tag=_ENTRY_TAGS,
+        recover=True, resolve_entities=False, no_network=True,
+    )
+    for _, el in ctx:
+        e: Dict[str, Any] = {}
+        guid = ""
+        for child in el:
+            if not isinstance(child.tag, str):
+                continue  # comentarios / PIs
+            name = etree.QName(child).localname
+            text = (child.text or "").strip()
+            if name == "title":
+                e["title"] = text
+            elif name == "link":
+                # Atom: <link rel="alternate" href=...>; RSS: texto
+                href = child.get("href")
+                if href is None:
+                    e.setdefault("link", text)
+                elif child.get("rel", "alternate") == "alternate":
+                    e["link"] = href
+            elif name == "guid":
+                # RSS 2.0: isPermaLink es "true" por omisión (como en feedparser)
+                if child.get("isPermaLink", "true").lower() == "true":
+                    guid = text
+            elif name in ("pubDate", "published", "date") or (name == "updated" and "published" not in e):
+                e["published"] = text
+            elif name in ("description", "summary") and text:
+                e["summary"] = text
+            elif name == "source":
+                # RSS: <source url=...>Nombre</source>; Atom: <source><title>Nombre</title>
+                e["source"] = text or (child.findtext(f"{_ATOM}title") or "").strip()
+            elif name in ("author", "creator"):
+                # RSS/dc: texto; Atom: <author><name>...</name></author>
+                e["author"] = text or (child.findtext(f"{_ATOM}name") or "").strip()
+        if not e.get("link") and guid.startswith(("http://", "https://")):
+            e["link"] = guid  # ítems cuya URL solo está en <guid>
+        parsed = _parse_date(e.get("published", ""))
+        e["published_parsed"] = tuple(parsed) if parsed else None
+        entries.append(e)
+        # memoria plana: se descarta la entrada y sus hermanos ya procesados
+        el.clear()
+        parent = el.getparent()
+        if parent is not None:
+            while el.getprevious() is not None:
+                del parent[0]
+    return entries
+
+def _parse_feed_fp(body: bytes) -> List[Dict[str, Any]]:
+    """Respaldo feedparser (feeds raros o sin lxml), al mismo formato plano."""
+    entries = []
+    for e in feedparser.parse(body).entries:
+        src = e.get("source")
+        parsed = e.get("published_parsed") or e.get("updated_parsed")
+        entries.append({
+            "title": e.get("title", ""),
+            "link": e.get("link", ""),
+            "published": e.get("published", "") or e.get("updated", ""),
+            "published_parsed": tuple(parsed) if parsed else None,
+            "summary": e.get("summary", ""),
+            "source": (src.get("title", "") or str(src)) if src else "",
+            "author": e.get("publisher", "") or e.get("author", ""),
+        })
+    return entries
+
+def _parse_feed(body: bytes) -> List[Dict[str, Any]]:
+    if etree is not None:
+        try:
+            entries = _parse_feed_lxml(body)
+            if entries:
+                return entries
+        except Exception:
+            pass
+    return _parse_feed_fp(body)
+
+def _load_parsed(path) -> List[Dict[str, Any]] | None:
+    try:
+        entries = _cache.loads(path.read_bytes())
+    except (OSError, ValueError):
+        return None
+    return entries if isinstance(entries, list) else None
+
+# (connect, read): read es el máximo entre bytes, no el total de la descarga
+_FEED_TIMEOUT = (5, 10)
+_FEED_CHUNK = 64 << 10
+
+
+class _FetchCancelled(Exception):
+    """fetch_news ya llenó sus cupos: la descarga en curso se abandona."""
+
+
+def _get_body(url: str, headers: Dict[str, str], stop: Optional[threading.Event]) -> Tuple[requests.Response, bytes]:
+    """GET en streaming; entre bloques se revisa `stop` para cortar descargas ya iniciadas."""
+    r = _SESSION.get(url, headers=headers, timeout=_FEED_TIMEOUT, stream=True)
+    buf = bytearray()
+    try:
+        if r.status_code != 304:
+            for chunk in r.iter_content(_FEED_CHUNK):
+                if stop is not None and stop.is_set():
+                    raise _FetchCancelled(url)
+                buf += chunk
+    finally:
+        r.close()
+    return r, bytes(buf)
+
+
+def _fetch_feed(url: str, stop: Optional[threading.Event] = None) -> List[Dict[str, Any]]:
+    base = _RSS_CACHE_DIR / hashlib.sha256(url.encode("utf-8")).hexdigest()
+    etag_p, lastmod_p, parsed_p = (base.with_suffix(x) for x in (".etag", ".lastmod", ".json"))
+
+    headers: Dict[str, str] = {}
+    try:
+        if time.time() - parsed_p.stat().st_mtime < RSS_CACHE_TTL_S:
+            entries = _load_parsed(parsed_p)
+            if entries is not None:
+                return entries
+        for name, p in (("If-None-Match", etag_p), ("If-Modified-Since", lastmod_p)):
+            try:
+                headers[name] = p.read_text(encoding="utf-8")
+            except OSError:
+                pass
+    except OSError:
+        pass  # sin caché: GET normal
+
+    if stop is not None and stop.is_set():
+        raise _FetchCancelled(url)
+    r, body = _get_body(url, headers, stop)
+    if r.status_code == 304:
+        entries = _load_parsed(parsed_p)
+        if entries is not None:
+            try:
+                os.utime(parsed_p)  # reinicia el TTL
+            except OSError:
+                pass
+            return entries
+        # caché ilegible/borrada: pedimos completo
+        r, body = _get_body(url, {}, stop)
     r.raise_for_status()
-    return feedparser.parse(r.content)
+    entries = _parse_feed(body)
+
+    try:
+        _cache.atomic_write(parsed_p, _cache.dumps(entries))
+        for hdr, p in (("ETag", etag_p), ("Last-Modified", lastmod_p)):
+            val = r.headers.get(hdr)
+            if val:
+                _cache.atomic_write(p, val.encode("utf-8"))
+            elif p.exists():
+                p.unlink()
+    except (OSError, TypeError):
+        pass  # la caché nunca rompe el flujo
+    return entries
 
 def _classify_topic(text: str) -> str:
     """
     Clasifica por la primera coincidencia de regex en TOPIC_PATTERNS.
     Si no hay match -> 'General'.
     """
-    for topic, patterns in TOPIC_PATTERNS.items():
-        if not patterns:
-            continue
-        for pat in patterns:
-            try:
-                if re.search(pat, text, flags=re.IGNORECASE):
-                    return topic
-            except re.error:
-                # Si hay un patrón mal escrito en YAML, lo ignoramos
-                continue
+    if TOPIC_MASTER is not None:
+        m = TOPIC_MASTER.match(text)
+        return _GROUP_TOPIC[m.lastgroup] if m else "General"
+    for topic, rx in TOPIC_REGEX.items():
+        if rx.search(text):
+            return topic
     return "General"
 
-def _normalize_entry(e: Any, now_ts: float) -> Dict[str, Any] | None:
-    title = (getattr(e, "title", "") or "").strip()
-    link = (getattr(e, "link", "") or "").strip()
+_DT_FMT = "%Y-%m-%d %H:%M"
+
+def _normalize_entry(e: Dict[str, Any], now_ts: float) -> Dict[str, Any] | None:
+    get = e.get  # un solo lookup del método por entrada
+    title = (get("title") or "").strip()
+    link = (get("link") or "").strip()
     if not title or not link:
         return None
 
     host = _host(link)
-    if WL and not any(w in host for w in WL):
+    if WL_SET and not _domain_match(host, WL_SET, WL_SUFFIX):
         return None
-    if BL and any(b in host for b in BL):
+    if BL_SET and _domain_match(host, BL_SET, BL_SUFFIX):
         return None
 
     # Fecha (si viene parseada, aplicamos filtro de antigüedad)
-    published_str = getattr(e, "published", "") or getattr(e, "updated", "")
-    parsed = getattr(e, "published_parsed", None) or getattr(e, "updated_parsed", None)
-    if isinstance(parsed, struct_time):
-        age_h = (now_ts - time.mktime(parsed)) / 3600.0
+    published_str = get("published") or ""
+    parsed = get("published_parsed")
+    if parsed:
+        parsed = tuple(parsed)  # la caché JSON lo devuelve como lista
+        # *_parsed viene en UTC: timegm (sin la conversión local/DST de mktime)
+        age_h = (now_ts - calendar.timegm(parsed)) / 3600.0
         if age_h > MAX_AGE_HOURS:
             return None
-        published_str = time.strftime("%Y-%m-%d %H:%M", parsed)
+        published_str = time.strftime(_DT_FMT, parsed)
 
     # Fuente
-    source_obj = getattr(e, "source", None)
-    source = ""
-    if source_obj:
-        source = getattr(source_obj, "title", "") or str(source_obj)
-    else:
-        source = getattr(e, "publisher", "") or getattr(e, "author", "") or host
+    source = get("source") or get("author") or host
 
-    # Tópico por patrones en título + resumen
-    summary = (getattr(e, "summary", "") or "")
-    topic = _classify_topic(f"{title}\n{summary}")
+    # Tópico por patrones en título + resumen (sin patrones, ni se arma el texto)
+    topic = _classify_topic(f"{title}\n{get('summary') or ''}") if _TOPIC_UNIONS else "General"
 
     return {
         "title": title,
@@ -218,31 +475,55 @@ def fetch_news(topics: List[str] | None = None, limit_per_topic: int | None = No
     per_topic_limit = LIMIT_PER_TOPIC if limit_per_topic is None else int(limit_per_topic)
     now_ts = time.time()
     out: List[Dict] = []
-    seen = set()
+    seen: set[Tuple[str, str]] = set()
     per_topic_count: Dict[str, int] = {}
+    # Tópicos posibles: los que tienen patrones válidos + General
+    n_topics = len(_TOPIC_UNIONS) + 1
+    full_topics = set()
 
-    for _, url in RSS_SOURCES:
-        try:
-            d = _fetch_feed(url)
-        except Exception:
-            continue
+    if not RSS_SOURCES or per_topic_limit <= 0:
+        return out
 
-        for e in d.entries:
-            item = _normalize_entry(e, now_ts)
-            if not item:
+    # Descargas en paralelo (I/O de red); el procesamiento sigue en este hilo y
+    # en el orden de RSS_SOURCES, así los cupos por tópico no dependen de la red
+    ex = ThreadPoolExecutor(max_workers=min(16, len(RSS_SOURCES)))
+    stop = threading.Event()
+    try:
+        futs = [ex.submit(_fetch_feed, url, stop) for _, url in RSS_SOURCES]
+        for f in futs:
+            try:
+                entries = f.result()
+            except Exception:
                 continue
 
-            topic = item["topic"]
-            per_topic_count.setdefault(topic, 0)
-            if per_topic_count[topic] >= per_topic_limit:
-                continue
+            for e in entries:
+                item = _normalize_entry(e, now_ts)
+                if not item:
+                    continue
 
-            key = (item["title"], item["link"])
-            if key in seen:
-                continue
+                topic = item["topic"]
+                per_topic_count.setdefault(topic, 0)
+                if per_topic_count[topic] >= per_topic_limit:
+                    continue
+
+                key = (item["title"], item["link"])
+                if key in seen:
+                    continue
 
-            out.append(item)
-            seen.add(key)
-            per_topic_count[topic] += 1
+                out.append(item)
+                seen.add(key)
+                per_topic_count[topic] += 1
+                if per_topic_count[topic] >= per_topic_limit:
+                    full_topics.add(topic)
+                    if len(full_topics) >= n_topics:
+                        break
+            if len(full_topics) >= n_topics:
+                break  # todos los cupos llenos: ni más entradas ni más feeds
+    finally:
+        # cancel_futures solo descarta feeds no iniciados; las descargas en curso
+        # ven `stop` en su siguiente bloque (o tras _FEED_TIMEOUT si el servidor
+        # no envía nada) y terminan, así el join de hilos al salir es corto
+        stop.set()
+        ex.shutdown(wait=False, cancel_futures=True)
 
     return out
@@ -1,14 +1,22 @@
 # src/report.py
 from __future__ import annotations
 
+import functools
 import os
+import re
+import tempfile
+from html import escape
 from pathlib import Path
 from datetime import datetime
-from typing import Dict, List, Tuple, Any
+from typing import Any, Callable, Dict, List, Tuple
 
 import pandas as pd
 
 
+# Marcadores __NOMBRE__ de templates/report.html (se sustituyen en una sola pasada)
+_PLACEHOLDER_RE = re.compile(r"__([A-Z][A-Z_]*?)__")
+
+
 def _fmt_dt(dt: datetime) -> str:
     try:
         return dt.astimezone().strftime("%Y-%m-%d %H:%M")
@@ -23,12 +31,36 @@ def _fmt_num(x: float, nd: int = 2) -> str:
         return str(x)
 
 
-def _file_uri(p: str) -> str:
-    if p.startswith(("http://", "https://", "file://")):
-        return p
-    if p.startswith("/"):
-        return "file://" + p
-    return p  # relativo
+_URI_SCHEMES = ("http://", "https://", "file://")
+
+
+def _chart_uris(chart_paths: List[str]) -> Dict[str, str]:
+    """ticker -> URI; particiona las rutas una vez (remotas/relativas tal cual, absolutas a file://)."""
+    as_is = [p for p in chart_paths if p.startswith(_URI_SCHEMES) or not p.startswith("/")]
+    absolute = [p for p in chart_paths if p.startswith("/")]
+    chart_map = {_chart_ticker(p): p for p in as_is}
+    chart_map.update({_chart_ticker(p): "file://" + p for p in absolute})
+    return chart_map
+
+
+@functools.lru_cache(maxsize=256)
+def _chart_ticker(p: str) -> str:
+    # TICKER_close.png / .webp / .svg
+    return os.path.basename(p).rsplit("_close.", 1)[0].upper()
+
+
+@functools.lru_cache(maxsize=2048)
+def _parse_iso(s: str) -> datetime:
+    # Muchas noticias comparten timestamp (mismo minuto / mismo feed)
+    try:
+        return datetime.fromisoformat(s)
+    except ValueError:
+        return datetime.min
+
+
+def _pub_key(n: Dict[str, Any]) -> datetime:
+    p = n.get("published")
+    return p if isinstance(p, datetime) else _parse_iso(str(p))
 
 
 def _group_news_by_topic(news: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
@@ -37,37 +69,20 @@ def _group_news_by_topic(news: List[Dict[str, Any]]) -> Dict[str, List[Dict[str,
         topic = (n.get("topic") or "General").strip()
         out.setdefault(topic, []).append(n)
 
-    for k in out:
-        def _key(n):
-            p = n.get("published")
-            if isinstance(p, datetime):
-                return p
-            try:
-                return datetime.fromisoformat(str(p))
-            except Exception:
-                return datetime.min
-        out[k] = sorted(out[k], key=_key, reverse=True)
+    for k, items in out.items():
+        # sort(key=...) ya calcula la clave una vez por elemento
+        items.sort(key=_pub_key, reverse=True)
     return out
 
 
-def _agenda_html(events: List[Dict[str, Any]], free_slots: List[Tuple[datetime, datetime]]) -> str:
-    if events:
-        rows = []
-        for e in events:
-            s = _fmt_dt(e["start"]).split(" ")[1]
-            title = (e.get("summary") or "(sin título)").strip()
-            rows.append(f'<div class="badge-row"><span class="badge">{s}</span><span class="evt">{title}</span></div>')
-        events_html = ''.join(rows)
-    else:
-        events_html = '<div class="empty">Sin eventos hoy</div>'
+# ---- Fragmentos HTML constantes (se rellenan con str.format) ----
 
-    if free_slots:
-        chips = [f'<span class="chip">{s.strftime("%H:%M")}–{e.strftime("%H:%M")}</span>' for s, e in free_slots]
-        gaps_html = ''.join(chips)
-    else:
-        gaps_html = '<div class="empty">Sin huecos de estudio</div>'
+_EMPTY_EVENTS = '<div class="empty">Sin eventos hoy</div>'
+_EMPTY_GAPS = '<div class="empty">Sin huecos de estudio</div>'
+_EMPTY_NEWS = '<div class="empty">Sin artículos recientes.</div>'
+_NO_CHART = '<div class="noimg">Sin gráfica</div>'
 
-    return f"""
+_SIDEBAR_SHELL = """
     <aside id="sidebar">
       <section class="card sticky">
         <div class="card-head"><h2>📅 Agenda de hoy</h2></div>
@@ -81,34 +96,15 @@ def _agenda_html(events: List[Dict[str, Any]], free_slots: List[Tuple[datetime,
     </aside>
     """
 
-
-def _markets_cards(stats: Dict[str, Dict[str, float]], chart_paths: List[str]) -> str:
-    chart_map: Dict[str, str] = {}
-    for p in chart_paths:
-        base = os.path.basename(p)
-        t = base.replace("_close.png", "").upper()
-        chart_map[t] = _file_uri(p)
-
-    cards = []
-    keys = sorted(set(list(stats.keys()) + list(chart_map.keys())))
-    for t in keys:
-        st = stats.get(t, {})
-        last = st.get("last")
-        pct = st.get("pct_change", 0.0)
-        cls = "up" if (pct or 0) > 0 else ("down" if (pct or 0) < 0 else "flat")
-        mn = st.get("min"); mx = st.get("max"); sd = st.get("std")
-        img = chart_map.get(t, "")
-
-        metrics = f"""
-          <div class="kv"><span>Last</span><b>{_fmt_num(last) if last is not None else '—'}</b></div>
-          <div class="kv"><span>d/d</span><b class="{cls}">{_fmt_num(pct,2)}%</b></div>
-          <div class="kv"><span>Mín</span><b>{_fmt_num(mn) if mn is not None else '—'}</b></div>
-          <div class="kv"><span>Máx</span><b>{_fmt_num(mx) if mx is not None else '—'}</b></div>
-          <div class="kv"><span>σ</span><b>{_fmt_num(sd) if sd is not None else '—'}</b></div>
+_METRICS_TMPL = """
+          <div class="kv"><span>Last</span><b>{last}</b></div>
+          <div class="kv"><span>d/d</span><b class="{cls}">{pct}%</b></div>
+          <div class="kv"><span>Mín</span><b>{mn}</b></div>
+          <div class="kv"><span>Máx</span><b>{mx}</b></div>
+          <div class="kv"><span>σ</span><b>{sd}</b></div>
         """
-        img_html = f'<img src="{img}" alt="{t} chart" loading="lazy"/>' if img else '<div class="noimg">Sin gráfica</div>'
 
-        cards.append(f"""
+_CARD_TMPL = """
         <div class="mkt-card">
           <div class="mkt-head">
             <div class="ticker">{t}</div>
@@ -119,13 +115,9 @@ def _markets_cards(stats: Dict[str, Dict[str, float]], chart_paths: List[str]) -
             <div class="chart">{img_html}</div>
           </div>
         </div>
-        """)
-
-    return "".join(cards)
-
+        """
 
-def _markets_html(stats: Dict[str, Dict[str, float]], chart_paths: List[str]) -> str:
-    return f"""
+_MARKETS_SHELL = """
     <section id="markets" class="card" data-carousel="markets">
       <div class="card-head">
         <h2>💹 Markets</h2>
@@ -138,7 +130,7 @@ def _markets_html(stats: Dict[str, Dict[str, float]], chart_paths: List[str]) ->
         <div class="carousel-wrap">
           <div class="viewport">
             <div class="track">
-              {_markets_cards(stats, chart_paths)}
+              {cards}
             </div>
           </div>
         </div>
@@ -146,58 +138,130 @@ def _markets_html(stats: Dict[str, Dict[str, float]], chart_paths: List[str]) ->
     </section>
     """
 
-
-def _news_html(news: List[Dict[str, Any]]) -> str:
-    groups = _group_news_by_topic(news)
-    topics = sorted(groups.keys(), key=lambda x: (x.lower() != "ai", x))
-
-    filters = ''.join(f'<button class="pill" data-topic="{t}">{t}</button>' for t in topics)
-
-    blocks = []
-    for t in topics:
-        lis = []
-        for a in groups[t]:
-            title = (a.get("title") or "").strip()
-            link = (a.get("link") or a.get("url") or "").strip()
-            src = (a.get("source") or "").strip()
-            pub = a.get("published")
-            pub_str = pub.strftime("%Y-%m-%d %H:%M") if isinstance(pub, datetime) else str(pub or "")
-            lis.append(f"""
-              <li class="news-item" data-topic="{t}">
-                <span class="dot"></span>
-                <a href="{link}" target="_blank" rel="noreferrer">{title}</a>
-                <div class="meta">{pub_str}{' · ' if pub_str and src else ''}<span class="src">{src}</span></div>
-              </li>
-            """)
-        blocks.append(f"""
-          <div class="news-group" data-group="{t}">
-            <div class="topic-chip">{t}</div>
-            <ul class="news-list">{''.join(lis)}</ul>
-          </div>
-        """)
-
-    content = ''.join(blocks) if blocks else '<div class="empty">Sin artículos recientes.</div>'
-
-    return f"""
+_NEWS_HEAD = """
     <section id="news" class="card">
       <div class="card-head">
         <h2>📰 Noticias</h2>
         <div class="filters">
           <button class="pill" data-topic="all" data-active="true">All</button>
-          {filters}
+          """
+_NEWS_FILTER_TMPL = '<button class="pill" data-topic="{t}">{t}</button>'
+_NEWS_BODY_OPEN = """
         </div>
       </div>
-      <div class="card-body">{content}</div>
+      <div class="card-body">"""
+_NEWS_GROUP_OPEN = """
+          <div class="news-group" data-group="{t}">
+            <div class="topic-chip">{t}</div>
+            <ul class="news-list">"""
+_NEWS_ITEM_TMPL = """
+              <li class="news-item" data-topic="{t}">
+                <span class="dot"></span>
+                <a href="{link}" target="_blank" rel="noreferrer">{title}</a>
+                <div class="meta">{pub}{sep}<span class="src">{src}</span></div>
+              </li>
+            """
+_NEWS_GROUP_CLOSE = """</ul>
+          </div>
+        """
+_NEWS_TAIL = """</div>
     </section>
     """
 
 
+def _agenda_html(events: List[Dict[str, Any]], free_slots: List[Tuple[datetime, datetime]]) -> str:
+    if events:
+        events_html = ''.join(
+            f'<div class="badge-row"><span class="badge">{_fmt_dt(e["start"]).split(" ")[1]}</span>'
+            f'<span class="evt">{escape((e.get("summary") or "(sin título)").strip())}</span></div>'
+            for e in events
+        )
+    else:
+        events_html = _EMPTY_EVENTS
+
+    if free_slots:
+        gaps_html = ''.join(f'<span class="chip">{s.strftime("%H:%M")}–{e.strftime("%H:%M")}</span>' for s, e in free_slots)
+    else:
+        gaps_html = _EMPTY_GAPS
+
+    return _SIDEBAR_SHELL.format(events_html=events_html, gaps_html=gaps_html)
+
+
+def _markets_cards(stats: Dict[str, Dict[str, float]], chart_paths: List[str]) -> str:
+    chart_map = _chart_uris(chart_paths)
+
+    cards = []
+    keys = sorted(stats.keys() | chart_map.keys())
+    for t in keys:
+        st = stats.get(t, {})
+        last = st.get("last")
+        pct = st.get("pct_change", 0.0)
+        cls = "up" if (pct or 0) > 0 else ("down" if (pct or 0) < 0 else "flat")
+        mn = st.get("min"); mx = st.get("max"); sd = st.get("std")
+        img = chart_map.get(t, "")
+
+        metrics = _METRICS_TMPL.format(
+            last=_fmt_num(last) if last is not None else '—',
+            cls=cls,
+            pct=_fmt_num(pct, 2),
+            mn=_fmt_num(mn) if mn is not None else '—',
+            mx=_fmt_num(mx) if mx is not None else '—',
+            sd=_fmt_num(sd) if sd is not None else '—',
+        )
+        img_html = f'<img src="{img}" alt="{t} chart" loading="lazy"/>' if img else _NO_CHART
+
+        cards.append(_CARD_TMPL.format(t=t, metrics=metrics, img_html=img_html))
+
+    return "".join(cards)
+
+
+def _markets_html(stats: Dict[str, Dict[str, float]], chart_paths: List[str]) -> str:
+    return _MARKETS_SHELL.format(cards=_markets_cards(stats, chart_paths))
+
+
+def _news_row(a: Dict[str, Any], t: str) -> Dict[str, str]:
+    # Título, enlace y fuente vienen de RSS (no confiables): siempre escapados
+    pub = a.get("published")
+    pub_str = escape(pub.strftime("%Y-%m-%d %H:%M") if isinstance(pub, datetime) else str(pub or ""))
+    src = escape((a.get("source") or "").strip())
+    return {
+        "t": t,
+        "link": escape((a.get("link") or a.get("url") or "").strip()),
+        "title": escape((a.get("title") or "").strip()),
+        "pub": pub_str,
+        "sep": " · " if pub_str and src else "",
+        "src": src,
+    }
+
+
+def _news_parts(news: List[Dict[str, Any]]) -> List[str]:
+    """Fragmentos de la sección de noticias, en orden (save_report los escribe sin unirlos)."""
+    groups = _group_news_by_topic(news)
+    topics = sorted(groups.keys(), key=lambda x: (x.lower() != "ai", x))
+
+    # Todos los fragmentos a una sola lista; un único join al final
+    parts: List[str] = [_NEWS_HEAD]
+    parts.extend(_NEWS_FILTER_TMPL.format(t=escape(t)) for t in topics)
+    parts.append(_NEWS_BODY_OPEN)
+
+    for topic in topics:
+        t = escape(topic)
+        parts.append(_NEWS_GROUP_OPEN.format(t=t))
+        parts.extend(_NEWS_ITEM_TMPL.format_map(_news_row(a, t)) for a in groups[topic])
+        parts.append(_NEWS_GROUP_CLOSE)
+    if not topics:
+        parts.append(_EMPTY_NEWS)
+
+    parts.append(_NEWS_TAIL)
+    return parts
+
+
 def save_report(
     out_path: str,
     news: List[Dict[str, Any]],
     events: List[Dict[str, Any]],
     free_slots: List[Tuple[datetime, datetime]],
-    prices: Dict[str, pd.DataFrame],  # no se usa directamente aquí, pero se mantiene la firma
+    prices: pd.DataFrame,  # panel (ticker, field); no se usa directamente aquí, pero se mantiene la firma
     stats: Dict[str, Dict[str, float]],
     chart_paths: List[str],
 ) -> str:
@@ -206,18 +270,41 @@ def save_report(
         raise FileNotFoundError("Falta templates/report.html")
 
     now = datetime.now().astimezone()
-    tzname = str = ((now.tzinfo.tzname(now) if now.tzinfo else None) or "Local")
-
-    html = template_path.read_text(encoding="utf-8")
-    html = (
-        html.replace("__DATE_TIME__", now.strftime("%Y-%m-%d %H:%M"))
-            .replace("__TZ__", tzname)
-            .replace("__GEN_AT__", now.strftime("%Y-%m-%d %H:%M"))
-            .replace("__SIDEBAR__", _agenda_html(events, free_slots))
-            .replace("__MARKETS__", _markets_html(stats, chart_paths))
-            .replace("__NEWS__", _news_html(news))
-    )
-
-    Path(os.path.dirname(out_path)).mkdir(parents=True, exist_ok=True)
-    Path(out_path).write_text(html, encoding="utf-8")
+    tzname = ((now.tzinfo.tzname(now) if now.tzinfo else None) or "Local")
+    stamp = now.strftime("%Y-%m-%d %H:%M")
+
+    # Cada sección se genera justo al llegar a su marcador y se escribe de inmediato:
+    # en memoria solo vive la sección en curso, nunca el HTML completo
+    sections: Dict[str, Callable[[], List[str]]] = {
+        "DATE_TIME": lambda: [stamp],
+        "TZ": lambda: [escape(tzname)],
+        "GEN_AT": lambda: [stamp],
+        "SIDEBAR": lambda: [_agenda_html(events, free_slots)],
+        "MARKETS": lambda: [_markets_html(stats, chart_paths)],
+        "NEWS": lambda: _news_parts(news),
+    }
+    template = template_path.read_text(encoding="utf-8")
+
+    out_dir = os.path.dirname(out_path) or "."
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    # tempfile + os.replace: el reporte publicado nunca queda a medio escribir
+    fd, tmp = tempfile.mkstemp(dir=out_dir, prefix=".tmp-", suffix=".html")
+    try:
+        with open(fd, "w", encoding="utf-8", buffering=1 << 20) as f:
+            pos = 0
+            # Una pasada sobre la plantilla (antes: seis .replace, cada uno re-copiando todo el HTML)
+            for m in _PLACEHOLDER_RE.finditer(template):
+                f.write(template[pos:m.start()])
+                fill = sections.get(m.group(1))
+                f.writelines(fill() if fill else [m.group(0)])
+                pos = m.end()
+            f.write(template[pos:])
+        os.chmod(tmp, 0o644)  # mkstemp crea 0600; el reporte se publica/sirve
+        os.replace(tmp, out_path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
     return out_path
@@ -2,16 +2,27 @@
 from __future__ import annotations
 
 import os
+import re
 import argparse
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from typing import Dict, Any, List, Tuple, Optional
+from itertools import chain
+from typing import Dict, Any, Iterator, List, Tuple, Optional
 
-from dotenv import load_dotenv
-load_dotenv()
+import requests
+from requests.adapters import HTTPAdapter
 
+import _bootstrap  # noqa: F401  (carga .env antes que el resto de módulos)
+import _cache
+
+try:
+    import fcntl  # POSIX: lock entre procesos (cron + corrida manual)
+except ImportError:
+    fcntl = None  # type: ignore[assignment]
 from news import fetch_news
 from finance import fetch_prices, basic_stats
-from calendar_sync import get_events_today_from_ics, find_free_slots_from_events
+from calendar_sync import get_events_today_from_ics, find_free_slots_from_events, write_study_ics
 from email_send import send_email
 
 # --- Config desde .env ---
@@ -19,75 +30,59 @@ REPORT_PUBLIC_URL      = (os.getenv("REPORT_PUBLIC_URL", "") or "").strip()
 REPORT_OUT_PATH        = os.getenv("REPORT_OUT_PATH", "docs/daily_report.html")
 STUDY_ICS_PATH         = os.getenv("STUDY_ICS_PATH", "docs/study_blocks.ics")
 EMAIL_SUBJECT_PREFIX   = os.getenv("EMAIL_SUBJECT_PREFIX", "[Daily Companion]")
-OLLAMA_MODEL           = (os.getenv("OLLAMA_MODEL", "qwen2.5:3b-instruct") or "qwen2.5:3b-instruct").strip()
+# El tag por defecto de la librería de Ollama ya es Q4_K_M (decode limitado por ancho
+# de banda de pesos); otro tag: `ollama pull <tag>` y OLLAMA_MODEL=<tag> en .env
+_DEFAULT_MODEL         = "qwen2.5:3b-instruct"
+OLLAMA_MODEL           = (os.getenv("OLLAMA_MODEL", _DEFAULT_MODEL) or _DEFAULT_MODEL).strip()
 DIGEST_LANG            = (os.getenv("DIGEST_LANG", "es") or "es").lower()  # es / en
+# Tope de tokens de salida: ~5 bullets + línea de mercados caben de sobra
+OLLAMA_NUM_PREDICT     = int(os.getenv("OLLAMA_NUM_PREDICT", "220"))
+# Mantener el modelo cargado entre corridas (evita recargar los pesos en cada cron)
+OLLAMA_KEEP_ALIVE      = (os.getenv("OLLAMA_KEEP_ALIVE", "2h") or "2h").strip()
+# llama-server (llama.cpp) directo, p.ej. http://127.0.0.1:8080; vacío -> Ollama
+# Ej.: llama-server -m qwen2.5-3b-instruct-q4_k_m.gguf --ctx-size 2048 --flash-attn --parallel 1 --n-gpu-layers -1
+LLAMA_SERVER_URL       = (os.getenv("LLAMA_SERVER_URL", "") or "").strip().rstrip("/")
+# Contexto mínimo para prompt (~300 tokens) + salida; crece si el prompt estimado no cabe
+OLLAMA_NUM_CTX         = 1024
+_CHARS_PER_TOKEN       = 3    # estimación conservadora (español ronda 3 chars/token)
+_TEMPLATE_TOKENS       = 32   # tokens de la plantilla de chat (roles, separadores)
+DIGEST_CACHE_TTL       = 4 * 3600  # reruns del mismo día con los mismos titulares -> sin LLM
+DIGEST_LAST_TTL        = 36 * 3600  # último digest: se reutiliza si los titulares no cambiaron desde ayer
+
+# Ollama local: IP literal (sin resolución DNS) y una sesión con keep-alive TCP
+_OLLAMA_URL = "http://127.0.0.1:11434"
+_OLLAMA_TIMEOUT = (2, 120)  # (connect, read): si el servidor no está, se cae al heurístico en 2 s
+_SESSION = requests.Session()
+_SESSION.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+# Cuerpos serializados con _cache.dumps (orjson): todos los POST son JSON
+_SESSION.headers["Content-Type"] = "application/json"
 
 
-# ---------- ICS helpers ----------
-def _fmt_dt_ics(dt: datetime) -> str:
-    # A ICS UTC
-    if dt.tzinfo is None:
-        dt = dt.replace(tzinfo=timezone.utc)
-    return dt.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
-
-
-def _write_study_ics(free_slots: List[Tuple[datetime, datetime]], path: str) -> Optional[str]:
-    """
-    Escribe un ICS básico con eventos "Study block" para los huecos recibidos.
-    Devuelve la ruta escrita o None si no se escribió.
-    """
-    if not free_slots:
-        return None
-
-    import uuid
-    from pathlib import Path
-
-    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//DailyStudyCompanion//EN"]
-    now = datetime.now(timezone.utc)
-
-    for s, e in free_slots:
-        uid = str(uuid.uuid4())
-        lines += [
-            "BEGIN:VEVENT",
-            f"UID:{uid}",
-            f"DTSTAMP:{_fmt_dt_ics(now)}",
-            f"DTSTART:{_fmt_dt_ics(s)}",
-            f"DTEND:{_fmt_dt_ics(e)}",
-            "SUMMARY:Study block",
-            "END:VEVENT",
-        ]
-
-    lines.append("END:VCALENDAR")
-    Path(os.path.dirname(path) or ".").mkdir(parents=True, exist_ok=True)
-    Path(path).write_text("\n".join(lines), encoding="utf-8")
-    return path
+# ---------- Digest helpers ----------
+_MKT_ORDER = ("NVDA", "MSFT", "AMZN", "TSLA", "SPY", "^GSPC")
+_MKT_ALIAS = {"^GSPC": "SPY"}  # sin índice: se usa el ETF
 
 
-# ---------- Digest helpers ----------
 def _markets_blurb(stats: Dict[str, Dict[str, float]]) -> str:
-    order = ("NVDA", "MSFT", "AMZN", "TSLA", "SPY", "^GSPC")
-    parts = []
-    for tk in order:
-        s = stats.get(tk) or (stats.get("SPY") if tk == "^GSPC" else None)
-        if not s:
-            continue
-        pct = s.get("pct_change")
-        if pct is None:
-            continue
-        parts.append(f"{tk} {pct:+.2f}%")
-    return " | ".join(parts)
+    return " | ".join(
+        f"{tk} {s['pct_change']:+.2f}%"
+        for tk in _MKT_ORDER
+        for s in (stats.get(tk) or stats.get(_MKT_ALIAS.get(tk, "")),)
+        if s and s.get("pct_change") is not None
+    )
 
 
 def _collect_headlines(news: List[Dict[str, Any]], k: int = 5) -> List[Tuple[str, str]]:
     """Devuelve [(source, title)] sin duplicados, hasta k."""
-    seen = set()
+    # Dedup por (fuente, título) en casefold (correcto para Unicode, más barato que lower)
+    seen: set[Tuple[str, str]] = set()
     out: List[Tuple[str, str]] = []
     for n in news:
         title = (n.get("title") or "").strip()
         if not title:
             continue
         source = (n.get("source") or "").strip() or "News"
-        key = (source.lower(), title.lower())
+        key = (source.casefold(), title.casefold())
         if key in seen:
             continue
         seen.add(key)
@@ -107,58 +102,210 @@ def _strip_code_fences(text: str) -> str:
     return t.strip()
 
 
+# Idioma resuelto una vez (es, es-MX, ... -> Spanish)
+_IS_ES = DIGEST_LANG.startswith("es")
+_LANG = "Spanish" if _IS_ES else "English"
+
+# DIGEST_LANG se lee al importar: el system prompt es constante (y el prefijo idéntico
+# entre corridas permite reutilizar la KV cache del servidor). No interpolar fechas aquí.
+_SYS_PROMPT = (
+    "You are a concise financial/tech briefing assistant. "
+    f"Respond in {_LANG}. "
+    "Return ONLY minimal HTML (h4, ul/li, p, strong). No CSS, no code fences.\n\n"
+    "Write EXACTLY one section:\n"
+    "  <h4>Top takeaways</h4>\n"
+    "    • 3–5 bullets synthesized across headlines (not title restatement).\n\n"
+    "Rules:\n"
+    "- Use ONLY the provided headlines; DO NOT invent facts.\n"
+    "- Each bullet ≤ 18 words.\n"
+    "- If markets_line is provided, append a final <p><strong>Markets:</strong> ...</p> exactly.\n"
+    "- Do NOT include any other sections or links."
+)
+
+
+def _ollama_warmup() -> None:
+    """Carga el modelo en Ollama (sin prompt) mientras se bajan los datos; silencioso si falla."""
+    if LLAMA_SERVER_URL:
+        return  # llama-server carga el modelo al arrancar
+    try:
+        _SESSION.post(f"{_OLLAMA_URL}/api/generate",
+                      data=_cache.dumps({"model": OLLAMA_MODEL, "keep_alive": OLLAMA_KEEP_ALIVE}), timeout=_OLLAMA_TIMEOUT)
+    except requests.RequestException:
+        pass
+
+
+def _llama_server_chat(messages: List[Dict[str, str]]) -> str:
+    """POST streaming al endpoint OpenAI-compatible de llama-server (SSE: "data: {...}")."""
+    payload = {
+        "messages": messages,
+        "stream": True,
+        "temperature": 0.2,
+        "max_tokens": OLLAMA_NUM_PREDICT,
+        "cache_prompt": True,  # reutiliza la KV cache del prefijo (system prompt) de la corrida anterior
+    }
+    print(f"[agent] Using llama-server: {LLAMA_SERVER_URL}")
+    chunks: List[str] = []
+    with _SESSION.post(f"{LLAMA_SERVER_URL}/v1/chat/completions", data=_cache.dumps(payload),
+                       timeout=_OLLAMA_TIMEOUT, stream=True) as r:
+        r.raise_for_status()
+        for line in r.iter_lines():
+            if not line.startswith(b"data: "):
+                continue
+            data = line[6:]
+            if data == b"[DONE]":
+                break
+            chunk = _cache.loads(data)
+            if "error" in chunk:
+                raise RuntimeError(f"llama-server: {chunk['error']}")
+            choices = chunk.get("choices") or [{}]
+            chunks.append((choices[0].get("delta") or {}).get("content") or "")
+    text = "".join(chunks)
+    if not text.strip():
+        raise RuntimeError("llama-server devolvió una respuesta vacía")
+    return text
+
+
+def _num_ctx(prompt_chars: int) -> int:
+    """
+    Contexto para prompt estimado + salida, redondeado a potencia de 2 (mínimo
+    OLLAMA_NUM_CTX): Ollama recorta el inicio del prompt (el system) si no cabe.
+    """
+    need = -(-prompt_chars // _CHARS_PER_TOKEN) + _TEMPLATE_TOKENS + OLLAMA_NUM_PREDICT
+    return max(OLLAMA_NUM_CTX, 1 << (need - 1).bit_length())
+
+
 def _ollama_digest(headlines: List[Tuple[str, str]], markets_line: str) -> str:
     """
     Llama a Ollama chat (local) para sintetizar titulares en HTML muy simple.
     """
-    import requests
-
     # Construcción de prompts
     hl_block = "\n".join(f"- [{src}] {ttl}" for src, ttl in headlines) if headlines else "(sin titulares)"
-    lang = "Spanish" if DIGEST_LANG.startswith("es") else "English"
-    sys_prompt = (
-        f"You are a concise financial/tech briefing assistant. Respond in {lang}. "
-        "Return ONLY minimal HTML (h4, ul/li, p, strong). No CSS, no code fences.\n\n"
-        "Write EXACTLY one section:\n"
-        "  <h4>Top takeaways</h4>\n"
-        "    • 3–5 bullets synthesized across headlines (not title restatement).\n\n"
-        "Rules:\n"
-        "- Use ONLY the provided headlines; DO NOT invent facts.\n"
-        "- Each bullet ≤ 18 words.\n"
-        "- If markets_line is provided, append a final <p><strong>Markets:</strong> ...</p> exactly.\n"
-        "- Do NOT include any other sections or links."
-    )
     user_prompt = (
         f"Headlines:\n{hl_block}\n\n"
         f"Markets: {markets_line or '(none)'}\n"
     )
 
+    messages = [
+        {"role": "system", "content": _SYS_PROMPT},
+        {"role": "user",  "content": user_prompt},
+    ]
+    if LLAMA_SERVER_URL:
+        return _strip_code_fences(_llama_server_chat(messages))
+
+    num_ctx = _num_ctx(len(_SYS_PROMPT) + len(user_prompt))
     payload = {
         "model": OLLAMA_MODEL,
-        "messages": [
-            {"role": "system", "content": sys_prompt},
-            {"role": "user",  "content": user_prompt},
-        ],
-        "stream": False,
-        "options": {"temperature": 0.2, "num_ctx": 4096},
+        "messages": messages,
+        "stream": True,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+        # KV cache proporcional al contexto: el mínimo que cabe (sin truncar en silencio)
+        "options": {"temperature": 0.2, "num_ctx": num_ctx, "num_predict": OLLAMA_NUM_PREDICT},
     }
 
     print(f"[agent] Using Ollama model: {OLLAMA_MODEL}")
-    r = requests.post("http://localhost:11434/api/chat", json=payload, timeout=120)
-    r.raise_for_status()
-    content = r.json()["message"]["content"]
-    return _strip_code_fences(content)
+    # Streaming: un objeto JSON por línea; se concatena hasta "done"
+    chunks: List[str] = []
+    with _SESSION.post(f"{_OLLAMA_URL}/api/chat", data=_cache.dumps(payload), timeout=_OLLAMA_TIMEOUT, stream=True) as r:
+        r.raise_for_status()
+        for line in r.iter_lines():
+            if not line:
+                continue
+            chunk = _cache.loads(line)
+            if "error" in chunk:
+                raise RuntimeError(f"Ollama: {chunk['error']}")
+            chunks.append((chunk.get("message") or {}).get("content") or "")
+            if chunk.get("done"):
+                break
+    text = _strip_code_fences("".join(chunks))
+    if not text:
+        # Como el r.json()["message"]["content"] original: sin contenido -> heurístico
+        raise RuntimeError("Ollama devolvió una respuesta vacía")
+    return text
 
 
 def _heuristic_digest(headlines: List[Tuple[str, str]], markets_line: str) -> str:
     # Fallback simple y limpio
-    items = "".join(f"<li>{ttl}</li>" for _, ttl in headlines[:5]) or "<li>Sin titulares hoy.</li>"
+    items = "".join(chain.from_iterable(("<li>", ttl, "</li>") for _, ttl in headlines[:5])) or "<li>Sin titulares hoy.</li>"
     body = f"<h4>Top takeaways</h4><ul>{items}</ul>"
     if markets_line:
         body += f'<p><strong>Markets:</strong> {markets_line}</p>'
     return body
 
 
+@contextlib.contextmanager
+def _file_lock(name: str) -> Iterator[None]:
+    """
+    flock exclusivo sobre CACHE_ROOT/locks/<name>.lock. Sin fcntl o sin permisos de
+    escritura (cron/launchd) se sigue sin lock: como la caché, nunca rompe el flujo.
+    """
+    f = None
+    if fcntl is not None:
+        try:
+            path = _cache.CACHE_ROOT / "locks" / f"{name}.lock"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            f = open(path, "wb")
+            fcntl.flock(f, fcntl.LOCK_EX)
+        except OSError:
+            if f is not None:
+                f.close()
+            f = None
+    try:
+        yield
+    finally:
+        if f is not None:
+            fcntl.flock(f, fcntl.LOCK_UN)
+            f.close()
+
+
+# Solo se cachea salida que parezca el HTML pedido (h4/ul/li/p/strong)
+_HTML_TAG_RE = re.compile(r"<(?:h4|ul|li|p|strong)\b", re.I)
+
+
+def _cacheable(html: str) -> bool:
+    return bool(html and html.strip() and _HTML_TAG_RE.search(html))
+
+
+def _cached_digest(key: str) -> Optional[str]:
+    """Digest cacheado para la clave; entradas corruptas o de otro tipo cuentan como miss."""
+    hit = _cache.get(key, ns="digest", ttl=DIGEST_CACHE_TTL)
+    return hit if isinstance(hit, str) and _cacheable(hit) else None
+
+
+def _digest_core(headlines: List[Tuple[str, str]], markets_line: str) -> str:
+    """Digest del modelo con atajos: sin titulares o mismas entradas que la última corrida -> sin LLM."""
+    if not headlines:
+        return _heuristic_digest(headlines, markets_line)
+
+    # Solo se cachea la respuesta del modelo; el heurístico es instantáneo
+    key = _cache.make_key({"headlines": headlines, "markets": markets_line,
+                           "model": OLLAMA_MODEL, "lang": _LANG,
+                           "server": LLAMA_SERVER_URL})
+    digest_core = _cached_digest(key)
+    if digest_core is not None:
+        return digest_core
+    last = _cache.get("last", ns="digest", ttl=DIGEST_LAST_TTL)
+    # Entrada corrupta u otro tipo JSON (lista/str): se ignora
+    if isinstance(last, dict) and last.get("key") == key and isinstance(last.get("html"), str):
+        return last["html"]
+
+    # Corridas concurrentes: la primera llama al LLM, las demás esperan el lock
+    # (un único archivo fijo, no uno por clave) y leen la caché que dejó escrita
+    with _file_lock("digest"):
+        digest_core = _cached_digest(key)
+        if digest_core is not None:
+            return digest_core
+        try:
+            digest_core = _ollama_digest(headlines, markets_line)
+        except Exception as e:
+            # p.ej. 404 si el modelo no está descargado (ollama pull OLLAMA_MODEL)
+            print(f"[agent] LLM no disponible ({e}); se usa el digest heurístico")
+            return _heuristic_digest(headlines, markets_line)
+        if _cacheable(digest_core):
+            _cache.put(key, digest_core, ns="digest")
+            _cache.put("last", {"key": key, "html": digest_core}, ns="digest")
+    return digest_core
+
+
 def build_digest_html(news: List[Dict[str, Any]],
                       stats: Dict[str, Dict[str, float]],
                       url_report: str,
@@ -166,11 +313,7 @@ def build_digest_html(news: List[Dict[str, Any]],
     today = datetime.now().strftime("%Y-%m-%d")
     headlines = _collect_headlines(news, k=5)
     markets_line = _markets_blurb(stats)
-
-    try:
-        digest_core = _ollama_digest(headlines, markets_line)
-    except Exception:
-        digest_core = _heuristic_digest(headlines, markets_line)
+    digest_core = _digest_core(headlines, markets_line)
 
     parts = [f"<h3>Daily Agent Digest — {today}</h3>", digest_core]
     if url_report:
@@ -186,17 +329,24 @@ def main():
     ap.add_argument("--dry-run", action="store_true", help="No envía email; imprime el digest HTML")
     args = ap.parse_args()
 
-    # 1) Datos
-    news_items = fetch_news()
-    prices = fetch_prices()
-    stats = basic_stats(prices)
+    # Un solo "ahora" por corrida: misma ventana de precios y DTSTAMP
+    now = datetime.now(timezone.utc)
+
+    # 1) Datos: noticias, precios e iCal son independientes (y de red): se bajan en paralelo
+    with ThreadPoolExecutor(max_workers=4) as ex:
+        # La carga del modelo se solapa con la E/S de red
+        ex.submit(_ollama_warmup)
+        f_news = ex.submit(fetch_news)
+        f_prices = ex.submit(fetch_prices, now=now)
+        f_events = ex.submit(get_events_today_from_ics)
 
-    events = get_events_today_from_ics()
-    free_slots = find_free_slots_from_events(events)
+        news_items = f_news.result()
+        stats = basic_stats(f_prices.result())
+        free_slots = find_free_slots_from_events(f_events.result())
 
     # 2) ICS (bloques de estudio) — solo si hay huecos
     public_ics_url = None
-    ics_path = _write_study_ics(free_slots, STUDY_ICS_PATH) if free_slots else None
+    ics_path = write_study_ics(free_slots, STUDY_ICS_PATH, now=now) if free_slots else None
     if ics_path and REPORT_PUBLIC_URL:
         # ej: https://.../daily_report.html  ->  https://.../study_blocks.ics
         base = REPORT_PUBLIC_URL.rsplit("/", 1)[0]